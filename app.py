@@ -14,9 +14,9 @@ import matplotlib.pyplot as plt
 # Import your footprint and registration functions.
 from source.transformation_horizontal.create_footprints.create_IFC_footprint_polygon import create_IFC_footprint_polygon, extract_building_storeys, extract_classes
 from source.transformation_horizontal.create_footprints.create_DXF_footprint_polygon import create_DXF_footprint_polygon
-from source.transformation_horizontal.create_footprints.create_CityGML_footprint import create_CityGML_footprint, extract_building_ids
+from source.transformation_horizontal.create_footprints.create_CityGML_footprint import create_CityGML_footprint, extract_building_ids, find_CityGML_buildings
 
-from source.transformation_horizontal.detect_features import detect_features, filter_features_by_feature_triangle_area
+from source.transformation_horizontal.detect_features import detect_features, detect_features_multiscale, filter_features_by_feature_triangle_area
 from source.transformation_horizontal.estimate_rigid_transformation import estimate_rigid_transformation, refine_rigid_transformation
 
 @st.cache_data(show_spinner=False)
@@ -129,6 +129,25 @@ elif page == "Footprint Creation":
                     default_sel_ids = pickle.load(f)
             else:
                 default_sel_ids = building_ids_all[0]
+            # The cached footprint belongs to the persisted selection, even if the default is replaced below
+            persisted_sel_ids = default_sel_ids
+
+            # Optionally select the buildings within an extent of the CityGML reference system
+            with st.expander("Select Buildings by Extent"):
+                col_min, col_max = st.columns(2)
+                min_x = col_min.number_input("Min. X", value=0.0, format="%.3f")
+                min_y = col_min.number_input("Min. Y", value=0.0, format="%.3f")
+                max_x = col_max.number_input("Max. X", value=0.0, format="%.3f")
+                max_y = col_max.number_input("Max. Y", value=0.0, format="%.3f")
+                extent_buffer = st.number_input("Buffer", min_value=0.0, value=0.0, format="%.1f")
+                if st.button("Select Buildings in Extent"):
+                    with st.spinner("Searching CityGML buildings…"):
+                        found_ids = find_CityGML_buildings(citygml_path, (min_x, min_y, max_x, max_y), buffer=extent_buffer)
+                    if found_ids:
+                        default_sel_ids = found_ids
+                        st.session_state.pop("citygml_sel_ids", None)
+                    else:
+                        st.warning("No buildings found in the given extent.")
 
             # Building ID selection
             sel_ids = st.multiselect(
@@ -145,7 +164,7 @@ elif page == "Footprint Creation":
             # Load existing footprint or create new one
             if len(sel_ids) > 0:
                 with st.spinner("Rendering CityGML footprints…"):
-                    if os.path.exists(footprint_path) and sel_ids == default_sel_ids:
+                    if os.path.exists(footprint_path) and sel_ids == persisted_sel_ids:
                         # Load cached footprint if selection hasn't changed
                         with open(footprint_path, 'rb') as f:
                             mp = pickle.load(f)
@@ -342,6 +361,19 @@ elif page == "Footprint Creation":
 # --- Corner Detection & Filtering ---
 elif page == "Corner Detection & Filtering":
     st.header("Corner Detection & Filtering")
+    # Multi-scale detection only keeps corners that persist while the footprint is simplified.
+    # The simplified footprints are cached, so moving the sliders does not simplify them again.
+    multiscale = st.sidebar.checkbox("Multi-scale corner detection", value=False, key="multiscale")
+    max_tolerance = st.sidebar.slider(
+        "Max. simplification tolerance", 0.1, 5.0, 1.0, key="multiscale_tolerance", disabled=not multiscale
+    )
+
+    def detect_corners(footprint, angle_threshold):
+        if multiscale:
+            tolerances = (0.0, max_tolerance / 4, max_tolerance / 2, max_tolerance)
+            return detect_features_multiscale(footprint, angle_threshold_deg=angle_threshold, tolerances=tolerances)
+        return detect_features(footprint, angle_threshold_deg=angle_threshold)
+
     col_cgml, col_ifc, col_dxf = st.columns(3)
 
     # --- CityGML column ---
@@ -357,7 +389,7 @@ elif page == "Corner Detection & Filtering":
                 "Filter Triangle Area", 0.0, 100.0, 15.0, key="min_area_cgml"
             )
             with st.spinner("Detecting and filtering features…"):
-                detected = detect_features(st.session_state.citygml_footprint, angle_threshold_deg=angle_threshold)
+                detected = detect_corners(st.session_state.citygml_footprint, angle_threshold)
                 filtered = filter_features_by_feature_triangle_area(detected, min_area)
                 st.session_state.citygml_features_filtered = filtered
             fig, ax = plt.subplots(figsize=(4, 4))
@@ -386,7 +418,7 @@ elif page == "Corner Detection & Filtering":
                 "Filter Triangle Area", 0.0, 100.0, 15.0, key="min_area_ifc"
             )
             with st.spinner("Detecting and filtering features…"):
-                detected = detect_features(st.session_state.ifc_footprint, angle_threshold_deg=angle_threshold)
+                detected = detect_corners(st.session_state.ifc_footprint, angle_threshold)
                 filtered = filter_features_by_feature_triangle_area(detected, min_area)
                 st.session_state.ifc_features_filtered = filtered
             fig, ax = plt.subplots(figsize=(4, 4))
@@ -415,7 +447,7 @@ elif page == "Corner Detection & Filtering":
                 "Filter Triangle Area", 0.0, 100.0, 15.0, key="min_area_dxf"
             )
             with st.spinner("Detecting and filtering features…"):
-                detected = detect_features(st.session_state.dxf_footprint, angle_threshold_deg=angle_threshold)
+                detected = detect_corners(st.session_state.dxf_footprint, angle_threshold)
                 filtered = filter_features_by_feature_triangle_area(detected, min_area)
                 st.session_state.dxf_features_filtered = filtered
             fig, ax = plt.subplots(figsize=(4, 4))
@@ -434,6 +466,9 @@ elif page == "Corner Detection & Filtering":
 # --- Rigid Registration Estimation ---
 elif page == "Rigid Registration Estimation":
     st.header("Rigid Registration Estimation")
+    # Registrations share one long-lived worker pool that outlives reruns of this script (see registration_pool).
+    # A single worker runs the registration serially.
+    max_workers = st.sidebar.number_input("Registration worker processes", min_value=1, value=os.cpu_count() or 1, step=1, key="max_workers")
     col_ifc, col_dxf = st.columns(2)
 
     # --- IFC to CityGML Registration ---
@@ -456,7 +491,8 @@ elif page == "Rigid Registration Estimation":
                 # 1) estimate
                 rigid_transformation_ifc, inlier_pairs_ifc = estimate_rigid_transformation(
                     features_ifc_filtered, features_citygml_filtered,
-                    distance_tol=distance_tol_ifc, angle_tol_deg=angle_tol_ifc
+                    distance_tol=distance_tol_ifc, angle_tol_deg=angle_tol_ifc,
+                    max_workers=max_workers
                 )
 
                 # 2) refine
@@ -503,7 +539,8 @@ elif page == "Rigid Registration Estimation":
                 # 1) estimate
                 rigid_transformation_dxf, inlier_pairs_dxf = estimate_rigid_transformation(
                     features_dxf_filtered, features_citygml_filtered,
-                    distance_tol=distance_tol_dxf, angle_tol_deg=angle_tol_dxf
+                    distance_tol=distance_tol_dxf, angle_tol_deg=angle_tol_dxf,
+                    max_workers=max_workers
                 )
 
                 # 2) refine
@@ -1,11 +1,12 @@
 # Footprint Creation Imports
-from source.transformation_horizontal.create_footprints.create_CityGML_footprint import create_CityGML_footprint
+from source.transformation_horizontal.create_footprints.create_CityGML_footprint import create_CityGML_footprint, find_CityGML_buildings
 from source.transformation_horizontal.create_footprints.create_IFC_footprint_polygon import create_IFC_footprint_polygon
 from source.transformation_horizontal.create_footprints.create_DXF_footprint_polygon import create_DXF_footprint_polygon
 
 # Horizontal Registration Imports
 from source.transformation_horizontal.rigid_transformation import Rigid_Transformation
 from source.transformation_horizontal.estimate_rigid_transformation import estimate_rigid_transformation, refine_rigid_transformation
+from source.transformation_horizontal.refine_icp import refine_rigid_transformation_icp
 from source.transformation_horizontal.detect_features import detect_features, filter_features_by_feature_triangle_area
 
 # Vertical Registration Imports
@@ -24,6 +25,7 @@ data_path = "./demo/data/"
 
 # ifc_path = "./test_data/ifc/3D_01_05_0501.ifc"
 citygml_building_ids = ["DEBY_LOD2_4959457"]
+citygml_extent = None  # Approximate extent (min_x, min_y, max_x, max_y) of the model; selects the CityGML buildings instead of citygml_building_ids
 
 # ifc_path = "./test_data/ifc/3D_01_05_0502.ifc"
 
@@ -41,6 +43,8 @@ dxf_layer = "A_09_TRAGDECKE"
 print("Creating Footprints...")
 ifc_footprint = create_IFC_footprint_polygon(ifc_path=ifc_path, ifc_type=ifc_type, building_storeys=building_storeys)
 dxf_footprint = create_DXF_footprint_polygon(dxf_path=dxf_path, layer_name=dxf_layer)
+if citygml_extent is not None:
+    citygml_building_ids = find_CityGML_buildings(citygml_path=citygml_path, extent=citygml_extent, buffer=5)
 citygml_footprint = create_CityGML_footprint(citygml_path=citygml_path, building_ids=citygml_building_ids)
 
 # Extract Features using Turning Function for detecting corners in footprints
@@ -60,6 +64,10 @@ print(f"Filtered Features: IFC: {len(ifc_features_filtered)}, DXF: {len(dxf_feat
 print("Estimating Rigid Transformation for IFC Footprint...")
 rough_transformation_ifc_to_citygml, inlier_pairs_ifc_to_citygml = estimate_rigid_transformation(source_features=ifc_features_filtered, target_features=citygml_features_filtered, distance_tol=1, angle_tol_deg=45)
 refined_transformation_ifc_to_citygml = refine_rigid_transformation(inlier_pairs=inlier_pairs_ifc_to_citygml)
+# Polish the corner-based estimate with point-to-line ICP on the full footprint boundaries
+icp_transformation_ifc_to_citygml = refine_rigid_transformation_icp(source_footprint=ifc_footprint, target_footprint=citygml_footprint, initial_transformation=refined_transformation_ifc_to_citygml, max_distance=1)
+if icp_transformation_ifc_to_citygml is not None:
+    refined_transformation_ifc_to_citygml = icp_transformation_ifc_to_citygml
 print(f"Transformation for IFC to CityGML: {refined_transformation_ifc_to_citygml}")
 
 # Transformation of IFC footprint to CityGML footprint and Feature Extraction
@@ -0,0 +1,324 @@
+import os
+import re
+import json
+import mmap
+import hashlib
+import numpy as np
+import xml.etree.ElementTree as ET
+
+
+# Namespaces of the CityGML versions supported by the readers.
+CITYGML_NAMESPACES = {
+    "2.0": {
+        'bldg': 'http://www.opengis.net/citygml/building/2.0',
+        'gml': 'http://www.opengis.net/gml'
+    },
+    "1.0": {
+        'bldg': 'http://www.opengis.net/citygml/building/1.0',
+        'gml': 'http://www.opengis.net/gml'
+    },
+}
+
+# Fully qualified tags of bldg:Building, mapped to the namespaces of their CityGML version.
+BUILDING_TAGS = {f"{{{ns['bldg']}}}Building": ns for ns in CITYGML_NAMESPACES.values()}
+
+GML_ID = "{http://www.opengis.net/gml}id"
+
+# Start and end tags of bldg:Building elements (with any namespace prefix) in the raw bytes of a CityGML file.
+BUILDING_TAG_PATTERN = re.compile(rb'<(/?)((?:[\w.-]+:)?Building)(?=[\s/>])([^>]*)>')
+ID_ATTRIBUTE_PATTERN = re.compile(rb'(?:^|\s)(?:[\w.-]+:)?id\s*=\s*["\']([^"\']*)["\']')
+ROOT_TAG_PATTERN = re.compile(rb'<(?![?!])[^>]*>')
+NAMESPACE_DECLARATION_PATTERN = re.compile(rb'\sxmlns(?::[\w.-]+)?\s*=\s*("[^"]*"|\'[^\']*\')')
+
+POSLIST_PATTERN = re.compile(rb'<(?:[\w.-]+:)?posList(?:\s[^>]*)?>([^<]*)</')
+
+# Format version of saved indices; indices of another version are rebuilt.
+INDEX_VERSION = 2
+
+# Building indices of the CityGML files used in this process, keyed by absolute path.
+_CityGML_indices = {}
+
+
+def hash_file(path) -> str:
+    """
+    Content hash of a file, used to recognise a CityGML tile whose modification time changed (e.g. a copy).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def decode_poslist(poslist) -> np.array:
+    """
+    Decode a gml:posList (the element, its text or raw bytes) into an (n,3) float64 array of x y z coordinates.
+    The whitespace separated values are converted in one bulk numpy call; an incomplete trailing triplet is dropped.
+    Raises ValueError if a value is not a number.
+    """
+    text = poslist.text if isinstance(poslist, ET.Element) else poslist
+    if not text:
+        return np.empty((0, 3))
+    coords = np.array(text.split(), dtype=float)
+    return coords[:len(coords) - len(coords) % 3].reshape(-1, 3)
+
+
+def compute_fragment_bounds(fragment: bytes):
+    """
+    Bounds of all posList coordinates (x y z triplets) in the raw bytes of a building element as
+    (min_x, min_y, max_x, max_y, min_z, max_z), or None if the building has no coordinates.
+    """
+    texts = POSLIST_PATTERN.findall(fragment)
+    if not texts:
+        return None
+    coords = np.concatenate([decode_poslist(text) for text in texts])
+    if len(coords) == 0:
+        return None
+    lower, upper = coords.min(axis=0), coords.max(axis=0)
+    return float(lower[0]), float(lower[1]), float(upper[0]), float(upper[1]), float(lower[2]), float(upper[2])
+
+
+class CityGML_Index:
+    """
+    Index of the bldg:Building elements of a CityGML file: for every gml:id the (start, end) byte offsets of the
+    element and its bounds (min_x, min_y, max_x, max_y, min_z, max_z) over all its posList coordinates.
+
+    The index is built in one pass over the raw bytes (memory mapped, without XML parsing). A building is then read
+    by seeking to its offsets and parsing only that fragment, wrapped in the namespace declarations of the
+    document root, so looking up any number of buildings costs one scan of the file in total; extents are
+    answered from the bounds without reading the file at all.
+    The index can be saved next to the CityGML file (see index_path). It is valid for the file size and modification
+    time it was built for, or, if only the modification time changed, as long as the content hash still matches.
+    """
+
+    def __init__(self, citygml_path, offsets=None, bounds=None, namespaces="", size=None, mtime=None, content_hash=None):
+        self.citygml_path = citygml_path
+        self.offsets = offsets if offsets is not None else {}
+        self.bounds = bounds if bounds is not None else {}
+        self.namespaces = namespaces
+        self.size = size
+        self.mtime = mtime
+        self.content_hash = content_hash
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, building_id):
+        return building_id in self.offsets
+
+    @staticmethod
+    def index_path(citygml_path):
+        return f"{citygml_path}.index.json"
+
+    @classmethod
+    def build(cls, citygml_path):
+        """
+        Scan a CityGML file once and index the byte offsets and bounds of all its buildings.
+        """
+        stat = os.stat(citygml_path)
+        offsets, bounds = {}, {}
+        namespaces = b""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(citygml_path, "rb") as f:
+            if stat.st_size == 0:
+                return cls(citygml_path, offsets, bounds, "", stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+                root_tag = ROOT_TAG_PATTERN.search(data)
+                if root_tag is not None:
+                    namespaces = b"".join(m.group(0) for m in NAMESPACE_DECLARATION_PATTERN.finditer(root_tag.group(0)))
+
+                start = building_id = None
+                for m in BUILDING_TAG_PATTERN.finditer(data):
+                    if not m.group(1):
+                        # Start tag; self-closing buildings have no geometry
+                        if m.group(3).rstrip().endswith(b"/"):
+                            continue
+                        id_attribute = ID_ATTRIBUTE_PATTERN.search(m.group(3))
+                        start, building_id = m.start(), id_attribute.group(1).decode() if id_attribute else None
+                    elif start is not None:
+                        if building_id is not None and building_id not in offsets:
+                            offsets[building_id] = (start, m.end())
+                            bounds[building_id] = compute_fragment_bounds(data[start:m.end()])
+                        start = building_id = None
+        return cls(citygml_path, offsets, bounds, namespaces.decode(), stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+
+    def is_valid(self) -> bool:
+        """
+        Whether the index still matches the CityGML file: same size and modification time, or same size
+        and content hash (the modification time is then updated).
+        """
+        try:
+            stat = os.stat(self.citygml_path)
+        except OSError:
+            return False
+        if stat.st_size != self.size:
+            return False
+        if stat.st_mtime_ns == self.mtime:
+            return True
+        if self.content_hash is not None and hash_file(self.citygml_path) == self.content_hash:
+            self.mtime = stat.st_mtime_ns
+            return True
+        return False
+
+    def save(self, path=None):
+        """
+        Save the index as JSON, by default next to the CityGML file.
+        """
+        with open(path or self.index_path(self.citygml_path), "w") as f:
+            json.dump({"version": INDEX_VERSION, "size": self.size, "mtime": self.mtime, "hash": self.content_hash,
+                       "namespaces": self.namespaces,
+                       "buildings": {b_id: {"offsets": list(offset), "bounds": self.bounds.get(b_id)}
+                                     for b_id, offset in self.offsets.items()}}, f)
+
+    @classmethod
+    def load(cls, citygml_path, path=None):
+        """
+        Load a saved index of a CityGML file. Returns None if there is none or it is not valid anymore.
+        """
+        try:
+            with open(path or cls.index_path(citygml_path)) as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return None
+            buildings = data["buildings"]
+            index = cls(citygml_path,
+                        {b_id: tuple(entry["offsets"]) for b_id, entry in buildings.items()},
+                        {b_id: tuple(entry["bounds"]) if entry["bounds"] else None for b_id, entry in buildings.items()},
+                        data["namespaces"], data["size"], data["mtime"], data["hash"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        mtime = index.mtime
+        if not index.is_valid():
+            return None
+        if index.mtime != mtime:
+            # Same content under a new modification time; keep the saved index in sync
+            try:
+                index.save(path)
+            except OSError:
+                pass
+        return index
+
+    def z_range(self, building_ids):
+        """
+        Combined (min_z, max_z) of the given indexed buildings, or None if none of them has coordinates.
+        """
+        bounds = [self.bounds[b_id] for b_id in building_ids if self.bounds.get(b_id) is not None]
+        if not bounds:
+            return None
+        return min(b[4] for b in bounds), max(b[5] for b in bounds)
+
+    def read_fragment(self, building_id) -> bytes:
+        """
+        Return the raw bytes of a building element, or None if the building is not in the index.
+        """
+        if building_id not in self.offsets:
+            return None
+        start, end = self.offsets[building_id]
+        with open(self.citygml_path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def read_building(self, building_id):
+        """
+        Parse only the fragment of one building and return its bldg:Building element, or None if it is not indexed.
+        """
+        fragment = self.read_fragment(building_id)
+        if fragment is None:
+            return None
+        wrapper = ET.fromstring(b"<index" + self.namespaces.encode() + b">" + fragment + b"</index>")
+        return wrapper[0]
+
+
+def get_CityGML_index(citygml_path, persist=True) -> CityGML_Index:
+    """
+    Return the building index of a CityGML file, shared by all readers in this process.
+    A valid index saved next to the file is reused; otherwise the file is scanned once and, with persist=True,
+    the new index is saved next to the file (if the directory is writable), so every tile is only scanned once.
+    """
+    key = os.path.abspath(citygml_path)
+    index = _CityGML_indices.get(key)
+    if index is None or not index.is_valid():
+        index = CityGML_Index.load(citygml_path)
+        if index is None:
+            index = CityGML_Index.build(citygml_path)
+            if persist:
+                try:
+                    index.save()
+                except OSError as e:
+                    print(f"Warning: Could not save the CityGML index: {e}")
+        _CityGML_indices[key] = index
+    return index
+
+
+def iterate_CityGML_buildings(citygml_path, building_ids=None, use_index=True):
+    """
+    Stream the bldg:Building elements of a CityGML file (2.0 or 1.0) with iterparse instead of loading
+    the whole document.
+
+    Yields (building_id, building, ns) as soon as the end tag of a building is parsed, where building is the complete
+    bldg:Building element and ns the namespace mapping of its CityGML version (for find/findall on the element).
+    The element is cleared once the consumer resumes the iteration, and already processed top-level elements are
+    dropped from the document root, so memory stays bounded by the largest building instead of the tile size.
+
+    If building_ids is given, only those buildings are yielded, in the requested order. With use_index=True they
+    are read directly at their byte offsets (see get_CityGML_index); otherwise the file is only streamed until all
+    were found. Raises xml.etree.ElementTree.ParseError for malformed files.
+    """
+    if building_ids and use_index:
+        index = get_CityGML_index(citygml_path)
+        unreadable = []
+        for building_id in dict.fromkeys(building_ids):
+            try:
+                building = index.read_building(building_id)
+            except ET.ParseError:
+                # The fragment is not self-contained (e.g. namespaces declared below the root); parse the file instead
+                unreadable.append(building_id)
+                continue
+            ns = BUILDING_TAGS.get(building.tag) if building is not None else None
+            if ns is not None:
+                yield building_id, building, ns
+        if unreadable:
+            yield from iterate_CityGML_buildings(citygml_path, unreadable, use_index=False)
+        return
+
+    wanted = set(building_ids) if building_ids else None
+    root = None
+    depth = 0
+    for event, element in ET.iterparse(citygml_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            depth += 1
+            continue
+
+        depth -= 1
+        ns = BUILDING_TAGS.get(element.tag)
+        if ns is not None:
+            building_id = element.get(GML_ID)
+            if wanted is None or building_id in wanted:
+                yield building_id, element, ns
+                if wanted is not None:
+                    wanted.discard(building_id)
+                    if not wanted:
+                        return
+            element.clear()
+        if depth == 1:
+            # A top-level member (e.g. core:cityObjectMember) is complete; release it.
+            root.clear()
+
+
+def iterate_CityGML_building_geometry(citygml_path, building_ids=None, surface=None):
+    """
+    Stream the posList elements of the buildings of a CityGML file (see iterate_CityGML_buildings).
+
+    Yields (building_id, poslists) per building, where poslists holds the gml:posList elements of the building's
+    surfaces of the given type (e.g. "GroundSurface"), or of all its geometry if surface is None.
+    """
+    for building_id, building, ns in iterate_CityGML_buildings(citygml_path, building_ids):
+        if surface is None:
+            poslists = building.findall('.//gml:posList', ns)
+        else:
+            poslists = [surface_element.find('.//gml:posList', ns)
+                        for surface_element in building.findall(f'.//bldg:{surface}', ns)]
+        yield building_id, poslists
@@ -1,8 +1,12 @@
+import os
 import matplotlib.pyplot as plt
 import numpy as np
 import xml.etree.ElementTree as ET
 
-from shapely.geometry import Polygon, MultiPolygon
+from shapely import STRtree
+from shapely.geometry import Polygon, MultiPolygon, box
+
+from source.read_CityGML import decode_poslist, iterate_CityGML_buildings, iterate_CityGML_building_geometry
 
 def create_CityGML_footprint(citygml_path, building_ids: list) -> MultiPolygon:
     """
@@ -10,83 +14,32 @@ def create_CityGML_footprint(citygml_path, building_ids: list) -> MultiPolygon:
     If building_ids (a list of strings) is provided, only footprints for those buildings
     (matched via the 'gml:id' attribute of bldg:Building elements) are returned.
     Otherwise, footprints from all ground surfaces in the file are processed.
+    The file is streamed building by building (see iterate_CityGML_buildings), so memory does not grow with its size.
     :param citygml_path: Path to the CityGML file
     :param building_ids: List of building IDs to process
     :return: MultiPolygon of the building footprints
     """
     try:
-        # Parse the CityGML file
-        tree = ET.parse(citygml_path)
-        root = tree.getroot()
-
-        # Define namespaces for 2.0 and 1.0
-        ns_2_0 = {
-            'bldg': 'http://www.opengis.net/citygml/building/2.0',
-            'gml': 'http://www.opengis.net/gml'
-        }
-        ns_1_0 = {
-            'bldg': 'http://www.opengis.net/citygml/building/1.0',
-            'gml': 'http://www.opengis.net/gml'
-        }
-
-        # Try to detect which namespace is present
-        buildings = root.findall('.//bldg:Building', ns_2_0)
-        ns = ns_2_0
-        if not buildings:
-            buildings = root.findall('.//bldg:Building', ns_1_0)
-            ns = ns_1_0
+        # Ground surface polygons per building, in the order the buildings are encountered
+        footprints = {}
+        for b_id, poslists in iterate_CityGML_building_geometry(citygml_path, building_ids, surface="GroundSurface"):
+            if building_ids and not poslists:
+                print(f"Warning: No GroundSurface found in building '{b_id}'.")
+            footprints.setdefault(b_id, []).extend(create_footprint_polygons(poslists))
 
         polygons = []
         if building_ids:
-            # Process ground surfaces only from specified buildings
+            # Keep the order of the requested buildings
             for b_id in building_ids:
-                building = root.find(f".//bldg:Building[@gml:id='{b_id}']", ns)
-                if building is None:
+                if b_id not in footprints:
                     print(f"Warning: No building found with gml:id '{b_id}'.")
                     continue
-                # Get GroundSurface elements within this building
-                ground_surfaces = building.findall(".//bldg:GroundSurface", ns)
-                if not ground_surfaces:
-                    print(f"Warning: No GroundSurface found in building '{b_id}'.")
-                for gs in ground_surfaces:
-                    posList = gs.find('.//gml:posList', ns)
-                    if posList is None:
-                        print("Warning: A GroundSurface element without a posList was found; skipping it.")
-                        continue
-
-                    # Coordinates should be space separated and form triplets (x y z)
-                    coords = list(map(float, posList.text.split()))
-                    # Extract x and y for the 2D polygon
-                    points = [(coords[i], coords[i + 1]) for i in range(0, len(coords), 3)]
-                    if len(points) >= 3:
-                        poly = Polygon(points)
-                        if poly.is_valid:
-                            polygons.append(poly)
-                        else:
-                            print("Warning: An invalid polygon was created; skipping it.")
-                    else:
-                        print("Warning: Not enough points to form a polygon; skipping.")
+                polygons.extend(footprints[b_id])
         else:
-            # Fall back to processing all ground surfaces in the file
-            ground_surfaces = root.findall('.//bldg:GroundSurface', ns)
-            if not ground_surfaces:
+            if not footprints:
                 raise ValueError("No ground surface found in the CityGML file.")
-            for gs in ground_surfaces:
-                posList = gs.find('.//gml:posList', ns)
-                if posList is None:
-                    print("Warning: A GroundSurface element without a posList was found; skipping it.")
-                    continue
-
-                coords = list(map(float, posList.text.split()))
-                points = [(coords[i], coords[i + 1]) for i in range(0, len(coords), 3)]
-                if len(points) >= 3:
-                    poly = Polygon(points)
-                    if poly.is_valid:
-                        polygons.append(poly)
-                    else:
-                        print("Warning: An invalid polygon was created; skipping it.")
-                else:
-                    print("Warning: Not enough points to form a polygon; skipping.")
+            for building_polygons in footprints.values():
+                polygons.extend(building_polygons)
 
         return MultiPolygon(polygons) if polygons else MultiPolygon([])
 
@@ -100,6 +53,32 @@ def create_CityGML_footprint(citygml_path, building_ids: list) -> MultiPolygon:
         print(f"An error occurred: {e}")
         return MultiPolygon([])
 
+def create_footprint_polygons(poslists) -> list:
+    """
+    Create the 2D footprint polygons from the gml:posList elements of ground surfaces.
+    :param poslists: posList elements (None for a surface without posList)
+    :return: List of valid Polygons
+    """
+    polygons = []
+    for posList in poslists:
+        if posList is None:
+            print("Warning: A GroundSurface element without a posList was found; skipping it.")
+            continue
+
+        # Coordinates should be space separated and form triplets (x y z)
+        coords = decode_poslist(posList)
+        # Extract x and y for the 2D polygon
+        points = coords[:, :2]
+        if len(points) >= 3:
+            poly = Polygon(points)
+            if poly.is_valid:
+                polygons.append(poly)
+            else:
+                print("Warning: An invalid polygon was created; skipping it.")
+        else:
+            print("Warning: Not enough points to form a polygon; skipping.")
+    return polygons
+
 def extract_building_ids(citygml_path: str) -> list:
     """_
     Extracts building IDs from a CityGML file.
@@ -107,22 +86,90 @@ def extract_building_ids(citygml_path: str) -> list:
     :return: List of building IDs (no None entries)
     """
     try:
-        tree = ET.parse(citygml_path)
-        root = tree.getroot()
-        ns = {
-            'bldg': 'http://www.opengis.net/citygml/building/2.0',
-            'gml': 'http://www.opengis.net/gml'
-        }
-
-        ids = []
-        # find all <bldg:Building> elements
-        for b in root.findall('.//bldg:Building', ns):
-            # attribute key is the full URI wrapped in {}
-            key = f"{{{ns['gml']}}}id"
-            bid = b.attrib.get(key)
-            if bid:
-                ids.append(bid)
-        return ids
+        # Stream all <bldg:Building> elements
+        return [bid for bid, _, _ in iterate_CityGML_buildings(citygml_path) if bid]
+
+    except ET.ParseError:
+        print(f"Error parsing CityGML file: {citygml_path}")
+        return []
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return []
+
+# Footprint trees of the CityGML files used in this process, keyed by absolute path.
+_CityGML_footprint_trees = {}
+
+
+class CityGML_Footprint_Tree:
+    """
+    R-tree (shapely STRtree) over the footprints of all buildings of a CityGML file.
+    The file is streamed once to build the tree; afterwards the buildings near a location, e.g. the approximate
+    extent of an IFC or DXF model in the CityGML reference system, are found in logarithmic time instead of
+    by reading every building.
+    """
+
+    def __init__(self, citygml_path):
+        self.citygml_path = citygml_path
+        stat = os.stat(citygml_path)
+        self.size, self.mtime = stat.st_size, stat.st_mtime_ns
+        self.building_ids, self.footprints = [], []
+        for b_id, poslists in iterate_CityGML_building_geometry(citygml_path, surface="GroundSurface"):
+            polygons = create_footprint_polygons(poslists)
+            if b_id and polygons:
+                self.building_ids.append(b_id)
+                self.footprints.append(MultiPolygon(polygons))
+        self.tree = STRtree(self.footprints)
+
+    def __len__(self):
+        return len(self.building_ids)
+
+    def is_valid(self) -> bool:
+        """
+        Whether the tree still matches the CityGML file (same size and modification time).
+        """
+        try:
+            stat = os.stat(self.citygml_path)
+        except OSError:
+            return False
+        return stat.st_size == self.size and stat.st_mtime_ns == self.mtime
+
+    def query(self, extent, buffer=0.0) -> list:
+        """
+        Return the IDs of the buildings whose footprint intersects the extent, in file order.
+        :param extent: Shapely geometry (e.g. a transformed source footprint) or bounding box (min_x, min_y, max_x, max_y)
+        :param buffer: Distance by which the extent is grown, to allow for an inaccurate location
+        :return: List of building IDs
+        """
+        geometry = extent if hasattr(extent, "geom_type") else box(*extent)
+        if buffer > 0:
+            geometry = geometry.buffer(buffer)
+        hits = self.tree.query(geometry, predicate="intersects")
+        return [self.building_ids[i] for i in sorted(hits)]
+
+
+def get_CityGML_footprint_tree(citygml_path) -> CityGML_Footprint_Tree:
+    """
+    Return the footprint tree of a CityGML file, shared by all queries in this process and rebuilt if the file changed.
+    """
+    key = os.path.abspath(citygml_path)
+    tree = _CityGML_footprint_trees.get(key)
+    if tree is None or not tree.is_valid():
+        tree = CityGML_Footprint_Tree(citygml_path)
+        _CityGML_footprint_trees[key] = tree
+    return tree
+
+
+def find_CityGML_buildings(citygml_path: str, extent, buffer=0.0) -> list:
+    """
+    Find the buildings of a CityGML file whose footprint intersects an extent (see CityGML_Footprint_Tree.query),
+    e.g. to select the target buildings for a source model instead of picking their IDs by hand.
+    :param citygml_path: Path to the CityGML file
+    :param extent: Shapely geometry or bounding box (min_x, min_y, max_x, max_y) in the CityGML reference system
+    :param buffer: Distance by which the extent is grown
+    :return: List of building IDs (empty on failure)
+    """
+    try:
+        return get_CityGML_footprint_tree(citygml_path).query(extent, buffer)
 
     except ET.ParseError:
         print(f"Error parsing CityGML file: {citygml_path}")
@@ -1,6 +1,10 @@
 import numpy as np
+import heapq
+import functools
 import matplotlib.pyplot as plt
 from matplotlib.patches import Polygon as MplPolygon
+from scipy.spatial import cKDTree
+from shapely.geometry import MultiPolygon
 
 from source.transformation_horizontal.create_footprints.create_CityGML_footprint import create_CityGML_footprint
 from source.transformation_horizontal.create_footprints.create_DXF_footprint_polygon import create_DXF_footprint_polygon
@@ -12,19 +16,14 @@ def compute_turning_angles(points: np.array) -> np.array:
     Compute the turning angles (in radians) at each vertex of a closed polygon.
     'points' is assumed to be a (n,2) numpy array of 2D vertices.
     """
-    n = len(points)
-    angles = []
-    for i in range(n):
-        prev = points[i - 1]
-        curr = points[i]
-        nxt = points[(i + 1) % n]
-        # Compute vectors for the incoming and outgoing edges.
-        v1 = curr - prev
-        v2 = nxt - curr
-        # Calculate the signed angle.
-        angle = np.arctan2(np.linalg.det([v1, v2]), np.dot(v1, v2))
-        angles.append(angle)
-    return np.array(angles)
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    # Vectors for the incoming and outgoing edges of every vertex.
+    v1 = points - np.roll(points, 1, axis=0)
+    v2 = np.roll(points, -1, axis=0) - points
+    # Signed angle from the cross and dot products.
+    cross = v1[:, 0] * v2[:, 1] - v1[:, 1] * v2[:, 0]
+    dot = v1[:, 0] * v2[:, 0] + v1[:, 1] * v2[:, 1]
+    return np.arctan2(cross, dot)
 
 def detect_features(footprint, angle_threshold_deg=30) -> np.array:
     """
@@ -41,34 +40,101 @@ def detect_features(footprint, angle_threshold_deg=30) -> np.array:
     features = []
     for poly_idx, poly in enumerate(footprint.geoms):
         # Remove the duplicate last point.
-        pts = np.array(poly.exterior.coords[:-1])
-        angles = compute_turning_angles(pts)
-        angles_deg = np.degrees(angles)
-        for i, angle in enumerate(angles_deg):
-            if abs(angle) >= angle_threshold_deg:
-                # Record: polygon index, vertex index, x, y, turning angle.
-                features.append([poly_idx, i, pts[i, 0], pts[i, 1], angle])
-    return np.array(features).reshape(-1, 5) if features else np.empty((0, 5))
+        pts = np.array(poly.exterior.coords[:-1]).reshape(-1, 2)
+        angles_deg = np.degrees(compute_turning_angles(pts))
+        # Record: polygon index, vertex index, x, y, turning angle.
+        vertex_idx = np.nonzero(np.abs(angles_deg) >= angle_threshold_deg)[0]
+        features.append(np.column_stack([
+            np.full(len(vertex_idx), poly_idx), vertex_idx, pts[vertex_idx], angles_deg[vertex_idx]
+        ]))
+    return np.concatenate(features).reshape(-1, 5) if features else np.empty((0, 5))
+
+
+@functools.lru_cache(maxsize=32)
+def simplify_footprint(footprint, tolerance) -> MultiPolygon:
+    """
+    Simplify a MultiPolygon footprint with the Douglas-Peucker tolerance (topology preserving).
+    Results are cached per footprint and tolerance, so detecting corners again with another angle threshold
+    (e.g. when a slider in app.py changes) does not simplify the footprint again.
+    """
+    if tolerance <= 0:
+        return footprint
+    simplified = footprint.simplify(tolerance, preserve_topology=True)
+    return simplified if isinstance(simplified, MultiPolygon) else MultiPolygon([simplified])
+
+
+def detect_features_multiscale(footprint, angle_threshold_deg=30, tolerances=(0.0, 0.25, 0.5, 1.0),
+                               min_persistence=None) -> np.array:
+    """
+    Detect features (corners) that persist across several scales of the footprint.
+
+    The footprint is simplified with each of the tolerances (see simplify_footprint) and corners are detected at
+    every scale. A corner of the finest scale (tolerances[0]) is kept if a corner is detected within the respective
+    tolerance (at least 1e-6) at min_persistence of the scales, by default all of them. Corners caused by noise
+    in the polylines vanish once the footprint is simplified, while the corners shaping the building persist.
+
+    Returns:
+        The persistent features of the finest scale in the format of detect_features. With tolerances[0] = 0 the
+        vertex indices refer to the original footprint, so the vertex-based filters can still be applied.
+    """
+    min_persistence = len(tolerances) if min_persistence is None else min_persistence
+    features = detect_features(simplify_footprint(footprint, tolerances[0]), angle_threshold_deg=angle_threshold_deg)
+    if len(features) == 0:
+        return features
+
+    persistence = np.zeros(len(features), dtype=np.intp)
+    for tolerance in tolerances:
+        scale_features = detect_features(simplify_footprint(footprint, tolerance), angle_threshold_deg=angle_threshold_deg)
+        if len(scale_features) == 0:
+            continue
+        distances, _ = cKDTree(scale_features[:, 2:4]).query(features[:, 2:4], distance_upper_bound=max(tolerance, 1e-6))
+        persistence += np.isfinite(distances)
+    return features[persistence >= min_persistence]
+
+
+@functools.lru_cache(maxsize=16)
+def get_footprint_vertices(footprint):
+    """
+    Return the exterior vertices of all polygons of a MultiPolygon footprint (without the duplicate closing points)
+    as one flat table, computed once per footprint and cached.
+
+    Returns:
+        A tuple (points, offsets, sizes) where points is a (n,2) array holding the vertices of all polygons
+        one after another, and offsets and sizes give the first row and the vertex count of every polygon.
+        The arrays are read-only, as they are shared between calls.
+    """
+    coords = [np.array(poly.exterior.coords[:-1]).reshape(-1, 2) for poly in footprint.geoms]
+    sizes = np.array([len(c) for c in coords], dtype=np.intp)
+    offsets = np.cumsum(sizes) - sizes
+    points = np.concatenate(coords) if coords else np.empty((0, 2))
+    for array in (points, offsets, sizes):
+        array.setflags(write=False)
+    return points, offsets, sizes
+
+
+def get_feature_vertex_neighbours(features: np.array, footprint):
+    """
+    Look up the previous, current and next footprint vertex of every feature (cyclic within its polygon).
+
+    Returns:
+        A tuple (prev, curr, nxt) of (n,2) coordinate arrays.
+    """
+    points, offsets, sizes = get_footprint_vertices(footprint)
+    poly_idx = features[:, 0].astype(np.intp)
+    offset, size = offsets[poly_idx], sizes[poly_idx]
+    idx = features[:, 1].astype(np.intp) % size
+    return points[offset + (idx - 1) % size], points[offset + idx], points[offset + (idx + 1) % size]
 
 
 def filter_features_by_edge_length(features: np.array, footprint, min_edge_len=2.0) -> np.array:
     """
     Filters out detected features if both the incoming and outgoing edge lengths are below min_edge_len.
     """
-    filtered_features = []
-    for feature in features:
-        poly_idx, vertex_idx, x, y, angle = feature
-        poly = footprint.geoms[int(poly_idx)]
-        pts = np.array(poly.exterior.coords[:-1])
-        n = len(pts)
-        idx = int(vertex_idx) % n
-        prev_idx = (idx - 1) % n
-        next_idx = (idx + 1) % n
-        edge_in = np.linalg.norm(pts[idx] - pts[prev_idx])
-        edge_out = np.linalg.norm(pts[next_idx] - pts[idx])
-        if edge_in >= min_edge_len or edge_out >= min_edge_len:
-            filtered_features.append(feature)
-    return np.array(filtered_features).reshape(-1, 5) if filtered_features else np.empty((0, 5))
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    prev, curr, nxt = get_feature_vertex_neighbours(features, footprint)
+    edge_in = np.linalg.norm(curr - prev, axis=1)
+    edge_out = np.linalg.norm(nxt - curr, axis=1)
+    return features[(edge_in >= min_edge_len) | (edge_out >= min_edge_len)]
 
 def filter_features_by_feature_edge_length(features: np.array, min_edge_len=2.0) -> np.array:
     """
@@ -87,35 +153,14 @@ def filter_features_by_feature_edge_length(features: np.array, min_edge_len=2.0)
     if features.size == 0:
         return np.empty((0, 5))
     
-    # Group features by polygon.
-    grouped_features = group_features_by_polygon(features)
-    filtered_features = []
-    
-    # For each feature, compute the edge length using its adjacent features in the grouped order.
-    for feature in features:
-        poly_idx = int(feature[0])
-        group = grouped_features.get(poly_idx, [])
-        n = len(group)
-        f_idx = None
-        for i, f in enumerate(group):
-            if int(f[1]) == int(feature[1]):
-                f_idx = i
-                break
-        if f_idx is None or n < 3:
-            continue
-        prev_f = group[(f_idx - 1) % n]
-        next_f = group[(f_idx + 1) % n]
-        p = np.array([prev_f[2], prev_f[3]])
-        c = np.array([feature[2], feature[3]])
-        npnt = np.array([next_f[2], next_f[3]])
-        
-        edge_in = np.linalg.norm(c - p)
-        edge_out = np.linalg.norm(npnt - c)
-        
-        if edge_in >= min_edge_len or edge_out >= min_edge_len:
-            filtered_features.append(feature)
-    
-    return np.array(filtered_features).reshape(-1, 5) if filtered_features else np.empty((0, 5))
+    # Adjacent features in the sorted order of each polygon.
+    prev_idx, next_idx, group_size = compute_feature_neighbours(features)
+    points = features[:, 2:4]
+    edge_in = np.linalg.norm(points - points[prev_idx], axis=1)
+    edge_out = np.linalg.norm(points[next_idx] - points, axis=1)
+
+    keep = (group_size >= 3) & ((edge_in >= min_edge_len) | (edge_out >= min_edge_len))
+    return features[keep].reshape(-1, 5)
 
 
 def filter_features_by_triangle_area(features: np.array, footprint, min_area=15) -> np.array:
@@ -123,21 +168,12 @@ def filter_features_by_triangle_area(features: np.array, footprint, min_area=15)
     Filters out detected features based on the area of the triangle
     formed by the feature vertex and its two neighbors (using all vertices).
     """
-    filtered_features = []
-    for feature in features:
-        poly_idx, vertex_idx, x, y, angle = feature
-        poly = footprint.geoms[int(poly_idx)]
-        pts = np.array(poly.exterior.coords[:-1])
-        n = len(pts)
-        idx = int(vertex_idx) % n
-        prev_idx = (idx - 1) % n
-        next_idx = (idx + 1) % n
-        area = 0.5 * abs((pts[prev_idx][0] * (pts[idx][1] - pts[next_idx][1]) +
-                          pts[idx][0] * (pts[next_idx][1] - pts[prev_idx][1]) +
-                          pts[next_idx][0] * (pts[prev_idx][1] - pts[idx][1])))
-        if area >= min_area:
-            filtered_features.append(feature)
-    return np.array(filtered_features).reshape(-1, 5) if filtered_features else np.empty((0, 5))
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    prev, curr, nxt = get_feature_vertex_neighbours(features, footprint)
+    area = 0.5 * np.abs(prev[:, 0] * (curr[:, 1] - nxt[:, 1]) +
+                        curr[:, 0] * (nxt[:, 1] - prev[:, 1]) +
+                        nxt[:, 0] * (prev[:, 1] - curr[:, 1]))
+    return features[area >= min_area]
 
 
 def filter_features_by_feature_triangle_area(features: np.array, min_area=0.5) -> np.array:
@@ -157,19 +193,142 @@ def filter_features_by_feature_triangle_area(features: np.array, min_area=0.5) -
     if features.size == 0:
         return np.empty((0, 5))
     
-    # Group features by polygon.
-    grouped_features = group_features_by_polygon(features)
-    filtered_features = []
-    
-    # For each feature, compute the triangle area using its adjacent features in the grouped order.
-    for feature in features:
-        result = compute_triangle_area_from_features(feature, grouped_features)
-        if result is not None:
-            area, _, _, _ = result
-            if area >= min_area:
-                filtered_features.append(feature)
-    
-    return np.array(filtered_features).reshape(-1, 5) if filtered_features else np.empty((0, 5))
+    # Features of polygons with fewer than 3 features have a NaN area and are dropped.
+    areas = compute_feature_triangle_areas(features)
+    return features[areas >= min_area].reshape(-1, 5)
+
+
+def compute_feature_triangle_areas(features: np.array) -> np.array:
+    """
+    Compute for every feature the area of the triangle formed with its adjacent detected features
+    (see compute_triangle_area_from_features).
+
+    Returns:
+        An array with one area per feature, NaN for features of polygons with fewer than 3 features.
+    """
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    prev_idx, next_idx, group_size = compute_feature_neighbours(features)
+    p, c, npnt = features[prev_idx, 2:4], features[:, 2:4], features[next_idx, 2:4]
+    areas = 0.5 * np.abs(p[:, 0] * (c[:, 1] - npnt[:, 1]) + c[:, 0] * (npnt[:, 1] - p[:, 1]) + npnt[:, 0] * (p[:, 1] - c[:, 1]))
+    areas[group_size < 3] = np.nan
+    return areas
+
+
+def compute_feature_neighbours(features: np.array):
+    """
+    Find the previous and next detected feature of every feature, cyclic within its polygon,
+    in the order of the vertex indices (see group_features_by_polygon).
+    The features are sorted once with np.lexsort on (polygon_index, vertex_index) and the neighbours
+    are found by rolling within each polygon's segment of the sorted array.
+
+    Returns:
+        A tuple (prev_idx, next_idx, group_size) of integer arrays with one entry per feature: the indices of
+        the previous and next feature and the number of features of the feature's polygon.
+    """
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    n = len(features)
+    if n == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, empty
+
+    poly_idx = features[:, 0].astype(np.int64)
+    order = np.lexsort((features[:, 1].astype(np.int64), poly_idx))
+    sorted_poly = poly_idx[order]
+
+    # Segment start and size of each polygon in the sorted order.
+    is_start = np.r_[True, sorted_poly[1:] != sorted_poly[:-1]]
+    starts = np.flatnonzero(is_start)
+    sizes = np.diff(np.r_[starts, n])
+    segment = np.cumsum(is_start) - 1
+    start, size = starts[segment], sizes[segment]
+    local = np.arange(n) - start
+
+    prev_idx, next_idx, group_size = (np.empty(n, dtype=np.intp) for _ in range(3))
+    prev_idx[order] = order[start + (local - 1) % size]
+    next_idx[order] = order[start + (local + 1) % size]
+    group_size[order] = size
+    return prev_idx, next_idx, group_size
+
+
+def select_strongest_features(features: np.array, max_features=None, per_polygon=False) -> np.array:
+    """
+    Select the max_features features spanning the largest triangles with their adjacent detected features.
+    With per_polygon=True, max_features applies to every polygon separately, so small polygons (e.g. one building
+    among larger ones) keep their strongest features as well.
+    The selected features keep their original order; with max_features=None all features are returned.
+    """
+    if max_features is None or len(features) <= max_features:
+        return features
+    areas = np.nan_to_num(compute_feature_triangle_areas(features), nan=-np.inf)
+    order = np.argsort(-areas, kind="stable")
+    if not per_polygon:
+        return features[np.sort(order[:max_features])]
+
+    # Rank of every feature within its polygon, by decreasing area
+    poly_idx = features[order, 0].astype(np.int64)
+    by_polygon = np.argsort(poly_idx, kind="stable")
+    sorted_poly = poly_idx[by_polygon]
+    starts = np.flatnonzero(np.r_[True, sorted_poly[1:] != sorted_poly[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    strongest = order[by_polygon[rank < max_features]]
+    return features[np.sort(strongest)]
+
+
+def prune_features_by_significance(features: np.array, max_features_per_polygon=None, min_area=None) -> np.array:
+    """
+    Iteratively prune detected features in the manner of Visvalingam-Whyatt line simplification.
+
+    Unlike filter_features_by_feature_triangle_area, which judges every feature once against its original
+    neighbours, the least significant feature (smallest triangle with its adjacent features) is removed one at a
+    time and the areas of its two neighbours are updated, so clusters of small corners collapse to the corner
+    that actually shapes the footprint. A heap keeps this at O(N log N).
+
+    Pruning of a polygon stops once it has at most max_features_per_polygon features and all its remaining
+    features span at least min_area (either criterion may be None). Polygons are never pruned below 3 features.
+
+    Returns:
+        The remaining features in their original order (same 5-column format).
+    """
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    if len(features) == 0 or (max_features_per_polygon is None and min_area is None):
+        return features
+
+    prev_idx, next_idx, group_size = compute_feature_neighbours(features)
+    prev_idx, next_idx = prev_idx.copy(), next_idx.copy()
+    poly_idx = features[:, 0].astype(np.int64)
+    remaining = dict(zip(poly_idx.tolist(), group_size.tolist()))
+    points = features[:, 2:4]
+
+    def triangle_area(i):
+        p, c, npnt = points[prev_idx[i]], points[i], points[next_idx[i]]
+        return 0.5 * abs(p[0] * (c[1] - npnt[1]) + c[0] * (npnt[1] - p[1]) + npnt[0] * (p[1] - c[1]))
+
+    def must_prune(i, area):
+        n = remaining[poly_idx[i]]
+        if n <= 3:
+            return False
+        return (max_features_per_polygon is not None and n > max_features_per_polygon) or \
+            (min_area is not None and area < min_area)
+
+    # Heap entries (area, index); entries are stale once the feature was removed or its area changed.
+    areas = compute_feature_triangle_areas(features)
+    heap = [(area, i) for i, area in enumerate(areas.tolist()) if group_size[i] > 3]
+    heapq.heapify(heap)
+    alive = np.ones(len(features), dtype=bool)
+    while heap:
+        area, i = heapq.heappop(heap)
+        if not alive[i] or area != areas[i] or not must_prune(i, area):
+            continue
+        # Remove feature i and update the areas of its neighbours.
+        alive[i] = False
+        remaining[poly_idx[i]] -= 1
+        before, after = prev_idx[i], next_idx[i]
+        next_idx[before], prev_idx[after] = after, before
+        for j in (before, after):
+            areas[j] = triangle_area(j)
+            heapq.heappush(heap, (areas[j], j))
+
+    return features[alive]
 
 
 def group_features_by_polygon(features: np.array) -> dict:
@@ -179,15 +338,12 @@ def group_features_by_polygon(features: np.array) -> dict:
     Each feature is assumed to be in the form:
        [polygon_index, vertex_index, x, y, turning_angle_deg]
     """
-    groups = {}
-    for f in features:
-        poly_idx = int(f[0])
-        if poly_idx not in groups:
-            groups[poly_idx] = []
-        groups[poly_idx].append(f)
-    for k in groups:
-        groups[k] = sorted(groups[k], key=lambda f: int(f[1]))
-    return groups
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    poly_idx = features[:, 0].astype(np.int64)
+    order = np.lexsort((features[:, 1].astype(np.int64), poly_idx))
+    sorted_poly = poly_idx[order]
+    splits = np.flatnonzero(sorted_poly[1:] != sorted_poly[:-1]) + 1
+    return {int(poly_idx[segment[0]]): list(features[segment]) for segment in np.split(order, splits) if len(segment)}
 
 def compute_triangle_area_from_features(feature, grouped_features):
     """
@@ -1,16 +1,19 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import itertools
-import concurrent.futures
-from functools import partial
+from scipy.spatial import ConvexHull, QhullError, cKDTree
 from shapely.geometry import Polygon, MultiPolygon
 
 from source.transformation_horizontal.create_footprints.create_CityGML_footprint import create_CityGML_footprint
-from source.transformation_horizontal.detect_features import detect_features, filter_features_by_edge_length, filter_features_by_feature_triangle_area
+from source.transformation_horizontal.detect_features import detect_features, filter_features_by_edge_length, filter_features_by_feature_triangle_area, select_strongest_features
 from source.transformation_horizontal.create_footprints.create_DXF_footprint_polygon import create_DXF_footprint_polygon
 from source.transformation_horizontal.create_footprints.create_IFC_footprint_polygon import create_IFC_footprint_polygon
 
 from source.transformation_horizontal.rigid_transformation import Rigid_Transformation
+from source.transformation_horizontal.registration_pool import map_candidate_chunks
+from source.transformation_horizontal.feature_descriptors import Feature_Descriptor_Index
+from source.transformation_horizontal.score_inliers import Target_Feature_Index, feature_points_and_angles, score_transformations, \
+    score_transformations_bounded
 
 
 def estimate_transformation_from_2pairs(source1, source2, target1, target2) -> Rigid_Transformation:
@@ -41,9 +44,29 @@ def estimate_transformation_from_2pairs(source1, source2, target1, target2) -> R
     return Rigid_Transformation(t=t, theta=theta)
 
 
-def evaluate_transformation_candidate(params, source_features, target_features, distance_tol, angle_tol, fixed_source=None, fixed_target=None):
+def estimate_transformations_from_2pairs(source1, source2, target1, target2):
+    """
+    Batched version of estimate_transformation_from_2pairs for K candidates at once.
+    All inputs are (K,2) arrays of corresponding points.
+
+    Returns:
+        A tuple (thetas, translations) with a (K,) array of rotation angles and a (K,2) array of translation vectors.
+    """
+    vector1 = source2 - source1
+    vector2 = target2 - target1
+    thetas = np.arctan2(vector2[:, 1], vector2[:, 0]) - np.arctan2(vector1[:, 1], vector1[:, 0])
+    cos_theta, sin_theta = np.cos(thetas), np.sin(thetas)
+    translations = np.column_stack([
+        target1[:, 0] - (cos_theta * source1[:, 0] - sin_theta * source1[:, 1]),
+        target1[:, 1] - (sin_theta * source1[:, 0] + cos_theta * source1[:, 1])
+    ])
+    return thetas, translations
+
+
+def evaluate_transformation_candidate(params, source_features, target_features, distance_tol, angle_tol, fixed_source=None, fixed_target=None, target_index=None):
     """
     Evaluate a single transformation candidate.
+    A prebuilt Target_Feature_Index for target_features can be passed as target_index to avoid rebuilding it.
     Returns (transformation, inliers, inlier_count)
     """
     # Unpack parameters
@@ -68,131 +91,602 @@ def evaluate_transformation_candidate(params, source_features, target_features,
         # Compute the transformation for unrestricted case
         candidate_transformation = estimate_transformation_from_2pairs(p1, p2, q1, q2)
     
-    # Evaluate inliers
-    inliers = []
-    for f in source_features:
-        pt = np.array(f[2:4])
-        ang = f[4]  # in degrees
-        pt_trans = candidate_transformation.rotation_matrix() @ pt + candidate_transformation.translation_vector()
-        best_match = None
-        for g in target_features:
-            pt2 = np.array(g[2:4])
-            ang2 = g[4]
-            if (np.linalg.norm(pt_trans - pt2) < distance_tol and 
-                abs(np.radians(ang) - np.radians(ang2)) < angle_tol):
-                best_match = g
-                break
-        if best_match is not None:
-            inliers.append((f, best_match))
-    
-    # For restricted case, ensure fixed pair is included
+    if target_index is None:
+        target_index = Target_Feature_Index(target_features)
+    theta, t = [candidate_transformation.theta], [candidate_transformation.translation_vector()]
+
+    # For restricted case, verify the fixed pair first: the transformed fixed source feature must match the fixed target
     if fixed_source is not None and fixed_target is not None:
-        fixed_pair_found = False
-        for src, tgt in inliers:
-            if np.array_equal(src, fixed_source) and np.array_equal(tgt, fixed_target):
-                fixed_pair_found = True
-                break
-        
-        # If fixed pair isn't included, this transformation isn't valid
-        if not fixed_pair_found:
+        fixed_match, _ = score_transformations(theta, t, np.asarray(fixed_source)[None], target_index, distance_tol, angle_tol)
+        if fixed_match[0, 0] < 0 or not np.array_equal(target_index.features[fixed_match[0, 0]], fixed_target):
             return None, [], 0
-    
+
+    # Evaluate inliers for all source features at once.
+    matches, _ = score_transformations(theta, t, source_features, target_index, distance_tol, angle_tol)
+    inliers = [(source_features[i], target_features[j]) for i, j in enumerate(matches[0]) if j >= 0]
+
     return candidate_transformation, inliers, len(inliers)
 
 
-def estimate_rigid_transformation(source_features, target_features, distance_tol=5.0, angle_tol_deg=10.0, 
-                                 restricted=False, fixed_source_idx=None, fixed_target_idx=None):
+def compute_angle_compatibility(source_features, target_features, angle_tol) -> np.array:
     """
-    Parallelized version of the rigid transformation estimation function.
+    Compute a boolean (n_source, n_target) matrix marking feature pairs whose turning angles differ
+    by less than angle_tol (radians), i.e. the putative correspondences.
+    """
+    _, source_angles = feature_points_and_angles(source_features)
+    _, target_angles = feature_points_and_angles(target_features)
+    return np.abs(source_angles[:, None] - target_angles[None, :]) < angle_tol
+
+
+def compute_feature_compatibility(source_features, target_features, angle_tol, descriptor_tol=None) -> np.array:
+    """
+    Compute the boolean (n_source, n_target) matrix of putative correspondences.
+    Without descriptor_tol this is compute_angle_compatibility; with descriptor_tol (a dict of descriptor
+    tolerances, see Feature_Descriptor_Index) the compatible target features are retrieved from a descriptor index.
+    """
+    if not descriptor_tol:
+        return compute_angle_compatibility(source_features, target_features, angle_tol)
+    return Feature_Descriptor_Index(target_features, angle_tol, descriptor_tol).compatibility_matrix(source_features)
+
+
+def count_exhaustive_candidates(source_features, target_features, angle_tol, distance_tol=None, limit=None,
+                                descriptor_tol=None) -> int:
+    """
+    Count the candidates the exhaustive enumeration would evaluate without scoring them:
+    every source pair combined with every ordered pair of distinct, angle-compatible target features.
+    With distance_tol, the pair length filter of generate_unrestricted_candidates is applied as well and
+    counting stops as soon as limit is exceeded.
+    """
+    if distance_tol is not None:
+        n_candidates = 0
+        for block in generate_unrestricted_candidates(source_features, target_features, angle_tol, distance_tol,
+                                                      descriptor_tol=descriptor_tol):
+            n_candidates += len(block)
+            if limit is not None and n_candidates > limit:
+                break
+        return n_candidates
+
+    compatible = compute_feature_compatibility(source_features, target_features, angle_tol, descriptor_tol).astype(np.int64)
+    counts = compatible.sum(axis=1)
+    # Target pairs using the same target feature for both source features are skipped.
+    shared = compatible @ compatible.T
+    pair_counts = np.outer(counts, counts) - shared
+    return int(np.triu(pair_counts, k=1).sum())
+
+
+def compute_feature_diameter(features) -> float:
+    """
+    Largest distance between two features, computed on the convex hull of the feature points.
+    """
+    points, _ = feature_points_and_angles(features)
+    if len(points) < 2:
+        return 0.0
+    try:
+        points = points[ConvexHull(points).vertices]
+    except (QhullError, ValueError):
+        # Collinear or coincident points: the extreme points along the longer axis span the diameter
+        axis = int(np.argmax(np.ptp(points, axis=0)))
+        points = points[[np.argmin(points[:, axis]), np.argmax(points[:, axis])]]
+    return float(np.max(np.linalg.norm(points[:, None] - points[None, :], axis=2)))
+
+
+def build_pair_distance_table(features, max_distance=None):
+    """
+    Build the table of all unordered feature pairs sorted by the distance between the two features.
+    With max_distance, only pairs at most max_distance apart are included. They are found with a KD-tree,
+    so memory grows with the number of close pairs instead of quadratically with the number of features.
+
+    Returns:
+        A tuple (distances, first, second) of arrays, sorted by distance, holding the pair distance
+        and the indices of the two features of each pair.
+    """
+    points, _ = feature_points_and_angles(features)
+    if max_distance is None:
+        first, second = np.triu_indices(len(points), k=1)
+    else:
+        pairs = cKDTree(points).query_pairs(max_distance, output_type="ndarray")
+        # Same pair order as the full table, so ties between equally long pairs are broken alike
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        first, second = pairs[:, 0], pairs[:, 1]
+    distances = np.linalg.norm(points[second] - points[first], axis=1)
+    order = np.argsort(distances, kind="stable")
+    return distances[order], first[order], second[order]
+
+
+def generate_unrestricted_candidates(source_features, target_features, angle_tol, distance_tol=None, descriptor_tol=None):
+    """
+    Lazily yield the unrestricted candidates as (k,8) arrays of rows [p1, p2, q1, q2], one block per source pair:
+    every pair of source features combined with every ordered pair of distinct target features with compatible
+    turning angles.
+
+    If distance_tol is given, only target pairs whose length differs by less than distance_tol from the source pair
+    length are generated (a rigid transformation cannot map both features of a pair onto the target pair otherwise).
+    The target pairs are looked up in a pair distance table sorted by length, which only holds the target pairs
+    up to the source diameter plus distance_tol apart.
+    With descriptor_tol, the features of a pair must also have compatible descriptors (see compute_feature_compatibility).
+    """
+    compatible = compute_feature_compatibility(source_features, target_features, angle_tol, descriptor_tol)
+    source_points, _ = feature_points_and_angles(source_features)
+    target_points, _ = feature_points_and_angles(target_features)
+
+    if distance_tol is None:
+        target_first, target_second = np.nonzero(~np.eye(len(target_points), dtype=bool))
+    else:
+        max_distance = compute_feature_diameter(source_features) + distance_tol
+        pair_distances, pair_first, pair_second = build_pair_distance_table(target_features, max_distance)
+
+    for i, j in itertools.combinations(range(len(source_points)), 2):
+        if distance_tol is not None:
+            # Both orientations of every target pair within the length tolerance.
+            source_distance = np.linalg.norm(source_points[j] - source_points[i])
+            lo, hi = np.searchsorted(pair_distances, [source_distance - distance_tol, source_distance + distance_tol])
+            target_first = np.concatenate([pair_first[lo:hi], pair_second[lo:hi]])
+            target_second = np.concatenate([pair_second[lo:hi], pair_first[lo:hi]])
+        keep = compatible[i, target_first] & compatible[j, target_second]
+        if not np.any(keep):
+            continue
+        k, l = target_first[keep], target_second[keep]
+        block = np.empty((len(k), 8))
+        block[:, 0:2] = source_points[i]
+        block[:, 2:4] = source_points[j]
+        block[:, 4:6] = target_points[k]
+        block[:, 6:8] = target_points[l]
+        yield block
+
+
+def generate_restricted_candidates(source_features, target_features, fixed_source_idx, fixed_target_idx):
+    """
+    Lazily yield the restricted candidates as (k,8) arrays of rows [fixed_p, other_p, fixed_q, other_q]:
+    the fixed correspondence combined with every other pair of source and target features.
+    """
+    source_points, _ = feature_points_and_angles(source_features)
+    target_points, _ = feature_points_and_angles(target_features)
+    other_targets = np.delete(np.arange(len(target_points)), fixed_target_idx)
+    for i in range(len(source_points)):
+        if i == fixed_source_idx:
+            continue
+        block = np.empty((len(other_targets), 8))
+        block[:, 0:2] = source_points[fixed_source_idx]
+        block[:, 2:4] = source_points[i]
+        block[:, 4:6] = target_points[fixed_target_idx]
+        block[:, 6:8] = target_points[other_targets]
+        yield block
+
+
+def iterate_candidate_chunks(candidate_blocks, chunk_size):
+    """
+    Regroup candidate blocks into (k,8) arrays of at most chunk_size rows [p1_x, p1_y, p2_x, p2_y, q1_x, q1_y, q2_x, q2_y].
+    """
+    pending, n_pending = [], 0
+    for block in candidate_blocks:
+        while len(block):
+            take = block[:chunk_size - n_pending]
+            block = block[len(take):]
+            pending.append(take)
+            n_pending += len(take)
+            if n_pending == chunk_size:
+                yield np.concatenate(pending)
+                pending, n_pending = [], 0
+    if pending:
+        yield np.concatenate(pending)
+
+
+def evaluate_candidate_chunk(params, source_features, target_features, target_index, distance_tol, angle_tol,
+                             fixed_source_idx=None, fixed_target_idx=None, best_score=None):
+    """
+    Score a chunk of candidates given as (k,8) array and return only its best candidate as
+    (inlier_count, position_in_chunk, theta, t), or None if no candidate has an inlier.
+    In the restricted case a candidate only counts if the fixed source feature is matched to the fixed target feature.
+    best_score is the running best of the registration call (see Best_Score): candidates that cannot reach it
+    are rejected early, and the best score of this chunk is published to it.
+    """
+    p1, p2, q1, q2 = params[:, 0:2], params[:, 2:4], params[:, 4:6], params[:, 6:8]
+    # Avoid degenerate cases
+    valid = np.nonzero((np.linalg.norm(p2 - p1, axis=1) >= 1e-3) & (np.linalg.norm(q2 - q1, axis=1) >= 1e-3))[0]
+    if valid.size == 0:
+        return None
+
+    thetas, translations = estimate_transformations_from_2pairs(p1[valid], p2[valid], q1[valid], q2[valid])
+    if fixed_source_idx is not None:
+        # Verify the fixed correspondence first, on the transformed fixed source feature alone
+        fixed_source = np.asarray(source_features)[[fixed_source_idx]]
+        fixed_matches, _ = score_transformations(thetas, translations, fixed_source, target_index, distance_tol, angle_tol)
+        keep = np.nonzero(fixed_matches[:, 0] == fixed_target_idx)[0]
+        if keep.size == 0:
+            return None
+        valid, thetas, translations = valid[keep], thetas[keep], translations[keep]
+
+    inlier_counts = score_transformations_bounded(thetas, translations, source_features, target_index,
+                                                  distance_tol, angle_tol, min_score=1, best_score=best_score)
+
+    best = int(np.argmax(inlier_counts))
+    if inlier_counts[best] <= 0:
+        return None
+    if best_score is not None:
+        best_score.update(inlier_counts[best])
+    return int(inlier_counts[best]), int(valid[best]), thetas[best], translations[best]
+
+
+def transformation_bin_sizes(source_features, distance_tol):
+    """
+    Choose the transform-space bin sizes used to cluster candidate transformations.
+
+    Translations are compared at the source centroid (the anchor) rather than at the coordinate origin, because
+    with georeferenced coordinates a tiny rotation difference moves the origin-based translation by metres.
+    The rotation bin is chosen so that it displaces the source feature farthest from the anchor by distance_tol / 2.
+
+    Returns:
+        A tuple (anchor, theta_step, translation_step).
+    """
+    source_points, _ = feature_points_and_angles(source_features)
+    anchor = source_points.mean(axis=0)
+    radius = max(np.max(np.linalg.norm(source_points - anchor, axis=1)), 1e-6)
+    return anchor, distance_tol / (2 * radius), distance_tol / 2
+
+
+def quantize_transformations(thetas, translations, anchor, theta_step, translation_step) -> np.array:
+    """
+    Map transformations to integer bins of a (theta, anchor_x, anchor_y) voting grid, where anchor_x/anchor_y
+    is the position of the transformed anchor point.
+
+    Returns:
+        A (K,3) int64 array of bin keys.
+    """
+    wrapped = np.mod(thetas + np.pi, 2 * np.pi) - np.pi
+    cos_theta, sin_theta = np.cos(thetas), np.sin(thetas)
+    anchor_x = cos_theta * anchor[0] - sin_theta * anchor[1] + translations[:, 0]
+    anchor_y = sin_theta * anchor[0] + cos_theta * anchor[1] + translations[:, 1]
+    return np.column_stack([
+        np.floor(wrapped / theta_step),
+        np.floor(anchor_x / translation_step),
+        np.floor(anchor_y / translation_step)
+    ]).astype(np.int64)
+
+
+def deduplicate_candidate_chunks(candidate_chunks, anchor, theta_step, translation_step):
+    """
+    Collapse candidates describing essentially the same transformation, so each transform-space bin is scored once.
+    Yields the candidate chunks reduced to the first candidate of every bin not seen before. The kept candidate is
+    not necessarily the best of its bin, so this suits initial guesses and hypothesis ranking, not the exact optimum.
+    """
+    seen = set()
+    for block in candidate_chunks:
+        thetas, translations = estimate_transformations_from_2pairs(block[:, 0:2], block[:, 2:4], block[:, 4:6], block[:, 6:8])
+        keys = quantize_transformations(thetas, translations, anchor, theta_step, translation_step)
+        _, first = np.unique(keys, axis=0, return_index=True)
+        keep = [k for k in np.sort(first) if tuple(keys[k]) not in seen]
+        seen.update(tuple(keys[k]) for k in keep)
+        if keep:
+            yield block[keep]
+
+
+def vote_transformations(candidate_chunks, anchor, theta_step, translation_step):
+    """
+    Hough-style voting: accumulate the candidate transformations in the quantised transform space.
+
+    Returns:
+        A list of clusters (votes, theta, t) sorted by decreasing votes, where theta and t are the
+        transformation of the first candidate that voted for the bin.
+    """
+    clusters = {}
+    for block in candidate_chunks:
+        thetas, translations = estimate_transformations_from_2pairs(block[:, 0:2], block[:, 2:4], block[:, 4:6], block[:, 6:8])
+        keys = quantize_transformations(thetas, translations, anchor, theta_step, translation_step)
+        unique_keys, first, votes = np.unique(keys, axis=0, return_index=True, return_counts=True)
+        for key, k, n in zip(map(tuple, unique_keys), first, votes):
+            if key in clusters:
+                clusters[key][0] += int(n)
+            else:
+                clusters[key] = [int(n), thetas[k], translations[k]]
+    return sorted((tuple(cluster) for cluster in clusters.values()), key=lambda cluster: -cluster[0])
+
+
+def estimate_rigid_transformation_by_voting(source_features, target_features, distance_tol=5.0, angle_tol_deg=10.0):
+    """
+    Fast initial guess for the rigid transformation: the unrestricted candidates vote in a quantised
+    transform space and the transformation of the cluster with the most votes is returned without
+    scoring any other candidate.
+
+    Returns:
+        A tuple (transformation, inlier_pairs) like estimate_rigid_transformation.
+    """
+    if len(source_features) < 2 or len(target_features) < 2:
+        print("Not enough features for estimation.")
+        return None, []
+    angle_tol = np.radians(angle_tol_deg)
+    anchor, theta_step, translation_step = transformation_bin_sizes(source_features, distance_tol)
+    candidates = generate_unrestricted_candidates(source_features, target_features, angle_tol, distance_tol)
+    clusters = vote_transformations(iterate_candidate_chunks(candidates, 4096), anchor, theta_step, translation_step)
+    if not clusters:
+        return None, []
+    _, theta, t = clusters[0]
+    matches, _ = score_transformations([theta], [t], source_features, target_features, distance_tol, angle_tol)
+    inliers = [(source_features[i], target_features[j]) for i, j in enumerate(matches[0]) if j >= 0]
+    return Rigid_Transformation(t=t, theta=theta), inliers
+
+
+def rank_transformation_hypotheses(source_features, target_features, distance_tol=5.0, angle_tol_deg=10.0, n_hypotheses=3):
+    """
+    Score all unrestricted candidates serially (one per transform-space bin) and return the n_hypotheses best
+    ones as a list of (inlier_count, theta, t), sorted by decreasing inlier count.
+    """
+    angle_tol = np.radians(angle_tol_deg)
+    target_index = Target_Feature_Index(target_features)
+    candidates = generate_unrestricted_candidates(source_features, target_features, angle_tol, distance_tol)
+    chunks = deduplicate_candidate_chunks(
+        iterate_candidate_chunks(candidates, 4096), *transformation_bin_sizes(source_features, distance_tol)
+    )
+    hypotheses = []
+    for chunk in chunks:
+        p1, p2, q1, q2 = chunk[:, 0:2], chunk[:, 2:4], chunk[:, 4:6], chunk[:, 6:8]
+        valid = (np.linalg.norm(p2 - p1, axis=1) >= 1e-3) & (np.linalg.norm(q2 - q1, axis=1) >= 1e-3)
+        thetas, translations = estimate_transformations_from_2pairs(p1[valid], p2[valid], q1[valid], q2[valid])
+        _, inlier_counts = score_transformations(thetas, translations, source_features, target_index, distance_tol, angle_tol)
+        top = np.argsort(-inlier_counts, kind="stable")[:n_hypotheses]
+        hypotheses.extend((int(inlier_counts[k]), thetas[k], translations[k]) for k in top if inlier_counts[k] > 0)
+        hypotheses = sorted(hypotheses, key=lambda hypothesis: -hypothesis[0])[:n_hypotheses]
+    return hypotheses
+
+
+def estimate_rigid_transformation_coarse_to_fine(source_features, target_features, distance_tol=5.0, angle_tol_deg=10.0,
+                                                 levels=(12, 48, None), coarse_tolerance_factor=4.0, n_hypotheses=3):
+    """
+    Multi-resolution estimation of the rigid transformation.
+
+    Only the strongest corners of both feature sets (levels[0] features of the source and of every target polygon,
+    see select_strongest_features) are registered exhaustively, with distance_tol scaled by coarse_tolerance_factor.
+    Selecting the target corners per polygon keeps every building of a multi-building target in the search, even
+    when the other buildings have larger corners. The n_hypotheses best coarse
+    hypotheses are then carried through the denser feature sets of the following levels (None for all features):
+    at each level a hypothesis is re-scored with a tolerance shrinking geometrically towards distance_tol and
+    re-fitted to its inliers by least squares. Only the coarse level is combinatorial, so the run time stays roughly
+    constant as the footprints get more detailed.
+
+    Returns:
+        A tuple (transformation, inlier_pairs) like estimate_rigid_transformation.
+    """
+    if len(source_features) < 2 or len(target_features) < 2:
+        print("Not enough features for estimation.")
+        return None, []
+
+    angle_tol = np.radians(angle_tol_deg)
+    tolerances = distance_tol * coarse_tolerance_factor ** np.linspace(1, 0, len(levels))
+    hypotheses = rank_transformation_hypotheses(
+        select_strongest_features(source_features, levels[0]),
+        select_strongest_features(target_features, levels[0], per_polygon=True),
+        distance_tol=tolerances[0], angle_tol_deg=angle_tol_deg, n_hypotheses=n_hypotheses
+    )
+
+    for max_features, tolerance in zip(levels[1:], tolerances[1:]):
+        level_source = select_strongest_features(source_features, max_features)
+        level_target = select_strongest_features(target_features, max_features, per_polygon=True)
+        target_index = Target_Feature_Index(level_target)
+        rescored = []
+        for _, theta, t in hypotheses:
+            matches, inlier_counts = score_transformations([theta], [t], level_source, target_index, tolerance, angle_tol)
+            best = (int(inlier_counts[0]), theta, t)
+            inliers = [(level_source[i], level_target[j]) for i, j in enumerate(matches[0]) if j >= 0]
+            if len(inliers) >= 2:
+                # Re-fit the hypothesis to its inliers and keep the fit if it explains more features
+                fitted = refine_rigid_transformation(inliers)
+                _, fitted_counts = score_transformations([fitted.theta], [fitted.t], level_source, target_index, tolerance, angle_tol)
+                if fitted_counts[0] >= best[0]:
+                    best = (int(fitted_counts[0]), fitted.theta, fitted.t)
+            rescored.append(best)
+        hypotheses = sorted(rescored, key=lambda hypothesis: -hypothesis[0])
+
+    if not hypotheses or hypotheses[0][0] == 0:
+        return None, []
+    _, theta, t = hypotheses[0]
+    matches, _ = score_transformations([theta], [t], source_features, target_features, distance_tol, angle_tol)
+    inliers = [(source_features[i], target_features[j]) for i, j in enumerate(matches[0]) if j >= 0]
+    return Rigid_Transformation(t=np.asarray(t), theta=theta), inliers
+
+
+def estimate_rigid_transformation_ransac(source_features, target_features, distance_tol=5.0, angle_tol_deg=10.0,
+                                         max_iterations=10000, confidence=0.99, batch_size=256, random_state=None,
+                                         descriptor_tol=None):
     """
+    Sampled RANSAC estimation of the rigid transformation.
+
+    Each iteration draws two putative correspondences (angle-compatible source/target feature pairs) with distinct
+    source and target features, computes the transformation they define and scores it on all source features.
+    Iterations are evaluated in batches. The number of required iterations is adapted from the observed inlier
+    ratio w (best inlier count / number of putative correspondences) as log(1 - confidence) / log(1 - w^2),
+    capped by max_iterations. With confidence=1.0 all max_iterations iterations are run.
+
+    Returns:
+        A tuple (transformation, inlier_pairs) like estimate_rigid_transformation.
+    """
+    if not 0.0 <= confidence <= 1.0:
+        raise ValueError(f"Invalid confidence {confidence}. Use a value between 0 and 1.")
+    angle_tol = np.radians(angle_tol_deg)
+    if len(source_features) < 2 or len(target_features) < 2:
+        print("Not enough features for estimation.")
+        return None, []
+
+    rng = np.random.default_rng(random_state)
+    target_index = Target_Feature_Index(target_features)
+    source_points, _ = feature_points_and_angles(source_features)
+    target_points = target_index.points
+    putative = np.argwhere(compute_feature_compatibility(source_features, target_features, angle_tol, descriptor_tol))
+    if len(putative) < 2:
+        print("Not enough compatible features for estimation.")
+        return None, []
+
     best_inlier_count = 0
     best_transformation = None
-    best_inliers = []
+    required_iterations = max_iterations
+    iteration = 0
+
+    while iteration < min(required_iterations, max_iterations):
+        n_samples = min(batch_size, max_iterations - iteration)
+        iteration += n_samples
+
+        # Draw pairs of putative correspondences and drop those sharing a source or target feature
+        # or whose source and target pair lengths cannot be reconciled by a rigid transformation.
+        first = putative[rng.integers(len(putative), size=n_samples)]
+        second = putative[rng.integers(len(putative), size=n_samples)]
+        p1, p2 = source_points[first[:, 0]], source_points[second[:, 0]]
+        q1, q2 = target_points[first[:, 1]], target_points[second[:, 1]]
+        source_lengths, target_lengths = np.linalg.norm(p2 - p1, axis=1), np.linalg.norm(q2 - q1, axis=1)
+        valid = ((first[:, 0] != second[:, 0]) & (first[:, 1] != second[:, 1]) &
+                 (source_lengths >= 1e-3) & (target_lengths >= 1e-3) &
+                 (np.abs(source_lengths - target_lengths) < distance_tol))
+        if not np.any(valid):
+            continue
+
+        thetas, translations = estimate_transformations_from_2pairs(p1[valid], p2[valid], q1[valid], q2[valid])
+        # Only hypotheses that can still beat the best one so far are scored to the end.
+        inlier_counts = score_transformations_bounded(thetas, translations, source_features, target_index,
+                                                      distance_tol, angle_tol, min_score=best_inlier_count + 1)
+
+        best = int(np.argmax(inlier_counts))
+        if inlier_counts[best] > best_inlier_count:
+            best_inlier_count = int(inlier_counts[best])
+            best_transformation = Rigid_Transformation(t=translations[best], theta=thetas[best])
+
+            # Adapt the number of iterations to the observed inlier ratio.
+            inlier_ratio = min(best_inlier_count / len(putative), 1.0)
+            good_sample_probability = inlier_ratio ** 2
+            if good_sample_probability >= 1.0:
+                break
+            if confidence < 1.0:
+                required_iterations = np.ceil(np.log(1.0 - confidence) / np.log(1.0 - good_sample_probability))
+                required_iterations = int(min(required_iterations, max_iterations))
+
+    if best_transformation is None:
+        return None, []
+    best_matches, _ = score_transformations(best_transformation.theta, best_transformation.t, source_features,
+                                            target_index, distance_tol, angle_tol)
+    best_inliers = [(source_features[i], target_features[j]) for i, j in enumerate(best_matches[0]) if j >= 0]
+    return best_transformation, best_inliers
+
+
+def estimate_rigid_transformation(source_features, target_features, distance_tol=5.0, angle_tol_deg=10.0, 
+                                 restricted=False, fixed_source_idx=None, fixed_target_idx=None,
+                                 mode="auto", max_exhaustive_candidates=50000, max_iterations=10000,
+                                 confidence=0.99, random_state=None, chunk_size=4096, max_workers=None,
+                                 min_parallel_candidates=20000, executor=None, deduplicate=False, descriptor_tol=None,
+                                 min_inlier_ratio=0.5):
+    """
+    Parallelized version of the rigid transformation estimation function.
+    Candidates are generated lazily and evaluated in chunks of chunk_size candidates, either in the given executor
+    or in the long-lived registration pool with max_workers processes (see registration_pool.map_candidate_chunks).
+    Below min_parallel_candidates candidates, or with max_workers=1, the evaluation runs serially.
+    With deduplicate=True, candidates falling into the same transform-space bin (see deduplicate_candidate_chunks)
+    are scored only once. This is a faster approximation: a bin spans about distance_tol at the farthest source
+    feature, so a discarded candidate may explain more inliers than the one kept. It is off by default so the
+    exhaustive estimation returns its optimum.
+
+    The unrestricted estimation either enumerates all candidate pairs ("exhaustive") or samples them with
+    RANSAC ("ransac", see estimate_rigid_transformation_ransac). With mode="auto" the exhaustive enumeration
+    is used as long as it produces at most max_exhaustive_candidates candidates. mode="coarse_to_fine" runs the
+    multi-resolution estimation (see estimate_rigid_transformation_coarse_to_fine); if its result explains fewer than
+    min_inlier_ratio of the source features, the estimation falls back to the exhaustive or RANSAC estimation of
+    mode="auto" and the result with more inliers is returned.
+    With descriptor_tol (e.g. {"convexity": 1.0, "edge_in": 2.0}), putative correspondences of the exhaustive and
+    RANSAC estimation must also agree in these feature descriptors (see Feature_Descriptor_Index), which prunes
+    incompatible target candidates early.
+    """
+    if mode not in ("auto", "exhaustive", "ransac", "coarse_to_fine"):
+        raise ValueError(f"Unknown estimation mode '{mode}'. Use 'auto', 'exhaustive', 'ransac' or 'coarse_to_fine'.")
+    if not 0.0 <= confidence <= 1.0:
+        raise ValueError(f"Invalid confidence {confidence}. Use a value between 0 and 1.")
+
     angle_tol = np.radians(angle_tol_deg)
     
     if len(source_features) < 2 or len(target_features) < 2:
         print("Not enough features for estimation.")
         return None, []
-    
-    # Prepare candidates for parallel processing
-    candidates = []
+    coarse_to_fine_result = None
     
     # Handle the restricted case with a fixed feature correspondence
     if restricted and fixed_source_idx is not None and fixed_target_idx is not None:
-        fixed_source = source_features[fixed_source_idx]
-        fixed_target = target_features[fixed_target_idx]
-        fixed_p = np.array(fixed_source[2:4])
-        fixed_q = np.array(fixed_target[2:4])
-        
-        # Loop over all other features to prepare candidate transformations
-        for i, other_source in enumerate(source_features):
-            if i == fixed_source_idx:
-                continue
-                
-            other_p = np.array(other_source[2:4])
-            
-            for j, other_target in enumerate(target_features):
-                if j == fixed_target_idx:
-                    continue
-                    
-                other_q = np.array(other_target[2:4])
-                
-                # Pre-compute the transformation
-                candidate_transformation = estimate_transformation_from_2pairs(fixed_p, other_p, fixed_q, other_q)
-                candidates.append((candidate_transformation, other_p, other_q))
-        
-        # Evaluate all candidates in parallel
-        evaluate_func = partial(
-            evaluate_transformation_candidate, 
-            source_features=source_features, 
-            target_features=target_features, 
-            distance_tol=distance_tol, 
-            angle_tol=angle_tol,
-            fixed_source=fixed_source,
-            fixed_target=fixed_target
-        )
+        # Every restricted candidate maps the fixed source feature onto the fixed target feature,
+        # so a fixed pair failing the angle gate rules out all of them
+        fixed_source, fixed_target = np.asarray(source_features)[[fixed_source_idx]], np.asarray(target_features)[[fixed_target_idx]]
+        if not compute_angle_compatibility(fixed_source, fixed_target, angle_tol)[0, 0]:
+            print("Fixed features have incompatible turning angles.")
+            return None, []
+        candidates = generate_restricted_candidates(source_features, target_features, fixed_source_idx, fixed_target_idx)
+        n_candidates = (len(source_features) - 1) * (len(target_features) - 1)
+        fixed_pair = {"fixed_source_idx": fixed_source_idx, "fixed_target_idx": fixed_target_idx}
     else:
-        # Original unrestricted estimation - prepare all feature pairs
-        for f1_1, f1_2 in itertools.combinations(source_features, 2):
-            p1, p2 = np.array(f1_1[2:4]), np.array(f1_2[2:4])
-            a1, a2 = np.radians(f1_1[4]), np.radians(f1_2[4])
-            
-            candidates1 = [f for f in target_features if abs(np.radians(f[4]) - a1) < angle_tol]
-            candidates2 = [f for f in target_features if abs(np.radians(f[4]) - a2) < angle_tol]
-            
-            if not candidates1 or not candidates2:
-                continue
-            
-            for f2_1 in candidates1:
-                for f2_2 in candidates2:
-                    if np.array_equal(f2_1, f2_2):
-                        continue
-                    q1, q2 = np.array(f2_1[2:4]), np.array(f2_2[2:4])
-                    
-                    # Add candidate parameters without pre-computing transformation
-                    candidates.append((p1, p2, q1, q2))
-        
-        # Evaluate all candidates in parallel
-        evaluate_func = partial(
-            evaluate_transformation_candidate, 
-            source_features=source_features, 
-            target_features=target_features, 
-            distance_tol=distance_tol, 
-            angle_tol=angle_tol
+        if mode == "coarse_to_fine":
+            coarse_to_fine_result = estimate_rigid_transformation_coarse_to_fine(
+                source_features, target_features, distance_tol=distance_tol, angle_tol_deg=angle_tol_deg
+            )
+            # The coarse levels only see the strongest corners; verify the result on the full feature sets
+            n_inliers = len(coarse_to_fine_result[1])
+            if n_inliers >= min_inlier_ratio * len(source_features):
+                return coarse_to_fine_result
+            print(f"Warning: The coarse-to-fine estimate explains only {n_inliers} of {len(source_features)} source "
+                  f"features; falling back to the exhaustive or RANSAC estimation.")
+            mode = "auto"
+
+        # Choose between the exhaustive enumeration and sampled RANSAC based on the candidate count
+        n_candidates = count_exhaustive_candidates(
+            source_features, target_features, angle_tol, distance_tol, limit=max(max_exhaustive_candidates, min_parallel_candidates),
+            descriptor_tol=descriptor_tol
         )
-    
-    # Execute parallel evaluation
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        results = list(executor.map(evaluate_func, candidates))
-    
-    # Process results to find the best transformation
-    for transformation, inliers, inlier_count in results:
-        if transformation is not None and inlier_count > best_inlier_count:
-            best_inlier_count = inlier_count
-            best_transformation = transformation
-            best_inliers = inliers
-    
-    return best_transformation, best_inliers
+        if mode == "auto":
+            mode = "exhaustive" if n_candidates <= max_exhaustive_candidates else "ransac"
+        if mode == "ransac":
+            ransac_result = estimate_rigid_transformation_ransac(
+                source_features, target_features, distance_tol=distance_tol, angle_tol_deg=angle_tol_deg,
+                max_iterations=max_iterations, confidence=confidence, random_state=random_state,
+                descriptor_tol=descriptor_tol
+            )
+            return select_best_estimate(ransac_result, coarse_to_fine_result)
+
+        # Original unrestricted estimation - enumerate all feature pairs lazily
+        candidates = generate_unrestricted_candidates(source_features, target_features, angle_tol, distance_tol,
+                                                      descriptor_tol=descriptor_tol)
+        fixed_pair = {}
+
+
+    # Small problems are evaluated serially, where process start-up and IPC would dominate
+    if n_candidates < min_parallel_candidates:
+        max_workers = 1
+
+    # Collapse duplicate hypotheses before they are shipped to the workers
+    chunks = iterate_candidate_chunks(candidates, chunk_size)
+    if deduplicate:
+        chunks = deduplicate_candidate_chunks(chunks, *transformation_bin_sizes(source_features, distance_tol))
+
+    # Evaluate the candidate chunks; each chunk only reports its best candidate
+    best = None  # (inlier_count, order, theta, t)
+    results = map_candidate_chunks(
+        evaluate_candidate_chunk, chunks, source_features, target_features,
+        max_workers=max_workers, executor=executor, distance_tol=distance_tol, angle_tol=angle_tol, **fixed_pair
+    )
+    for chunk_idx, result in results:
+        if result is None:
+            continue
+        inlier_count, position, theta, t = result
+        order = (chunk_idx, position)
+        # Keep the first candidate (in enumeration order) among those with the most inliers
+        if best is None or inlier_count > best[0] or (inlier_count == best[0] and order < best[1]):
+            best = (inlier_count, order, theta, t)
+
+    if best is None:
+        return select_best_estimate((None, []), coarse_to_fine_result)
+
+    # Only the winning candidate's inlier list is built
+    best_transformation = Rigid_Transformation(t=best[3], theta=best[2])
+    matches, _ = score_transformations([best[2]], [best[3]], source_features, target_features, distance_tol, angle_tol)
+    best_inliers = [(source_features[i], target_features[j]) for i, j in enumerate(matches[0]) if j >= 0]
+    return select_best_estimate((best_transformation, best_inliers), coarse_to_fine_result)
+
+
+def select_best_estimate(*estimates):
+    """
+    Return the (transformation, inlier_pairs) estimate with the most inliers, preferring the first one on ties.
+    Missing estimates (None) are ignored.
+    """
+    estimates = [estimate for estimate in estimates if estimate is not None]
+    return max(estimates, key=lambda estimate: len(estimate[1]))
 
 
 def refine_rigid_transformation(inlier_pairs):
@@ -239,6 +733,72 @@ def refine_rigid_transformation(inlier_pairs):
     return refined_transformation
 
 
+def fit_weighted_rigid_transformation(P, Q, weights):
+    """
+    Closed-form weighted least squares rigid transformation mapping the (n,2) points P onto Q.
+    In 2D the optimal rotation angle follows directly from the weighted cross-covariance, so no SVD is needed.
+    Returns (theta, t).
+    """
+    centroid_P = weights @ P / weights.sum()
+    centroid_Q = weights @ Q / weights.sum()
+    P_centered, Q_centered = P - centroid_P, Q - centroid_Q
+    theta = np.arctan2(
+        weights @ (P_centered[:, 0] * Q_centered[:, 1] - P_centered[:, 1] * Q_centered[:, 0]),
+        weights @ (P_centered[:, 0] * Q_centered[:, 0] + P_centered[:, 1] * Q_centered[:, 1])
+    )
+    R = Rigid_Transformation(theta=theta).rotation_matrix()
+    return theta, centroid_Q - R @ centroid_P
+
+
+def refine_rigid_transformation_robust(inlier_pairs, loss="huber", scale=None, max_iterations=20, tol=1e-10):
+    """
+    Robust variant of refine_rigid_transformation using iteratively reweighted least squares (IRLS).
+
+    Starting from the unweighted fit, each iteration weights the inlier pairs by their residual distance with
+    the Huber (down-weights large residuals) or Tukey biweight (ignores residuals beyond the cut-off) loss and
+    refits, so a few wrong pairs from a loose distance_tol no longer drag the solution.
+    The residual scale defaults to 1.4826 * median absolute residual of the current fit.
+
+    Returns:
+        A tuple (transformation, residuals, weights) with the refined Rigid_Transformation and the final residual
+        distance and weight of every inlier pair, or (None, [], []) if there are not enough pairs.
+    """
+    if loss not in ("huber", "tukey"):
+        raise ValueError(f"Unknown loss '{loss}'. Use 'huber' or 'tukey'.")
+    if len(inlier_pairs) < 2:
+        print("Not enough inlier pairs for refinement. Returning None.")
+        return None, [], []
+
+    P = np.array([pair[0][2:4] for pair in inlier_pairs], dtype=float)
+    Q = np.array([pair[1][2:4] for pair in inlier_pairs], dtype=float)
+    weights = np.ones(len(P))
+    theta, t = fit_weighted_rigid_transformation(P, Q, weights)
+
+    for _ in range(max_iterations):
+        R = Rigid_Transformation(theta=theta).rotation_matrix()
+        residuals = np.linalg.norm(P @ R.T + t - Q, axis=1)
+        sigma = scale if scale is not None else 1.4826 * np.median(residuals)
+        sigma = max(sigma, 1e-12)
+
+        if loss == "huber":
+            cutoff = 1.345 * sigma
+            weights = np.minimum(1.0, cutoff / np.maximum(residuals, 1e-300))
+        else:
+            cutoff = 4.685 * sigma
+            weights = np.where(residuals < cutoff, (1.0 - (residuals / cutoff) ** 2) ** 2, 0.0)
+        if np.count_nonzero(weights) < 2:
+            break
+
+        previous_theta, previous_t = theta, t
+        theta, t = fit_weighted_rigid_transformation(P, Q, weights)
+        if abs(theta - previous_theta) < tol and np.linalg.norm(t - previous_t) < tol * max(1.0, np.linalg.norm(t)):
+            break
+
+    R = Rigid_Transformation(theta=theta).rotation_matrix()
+    residuals = np.linalg.norm(P @ R.T + t - Q, axis=1)
+    return Rigid_Transformation(t=t, theta=theta), residuals, weights
+
+
 def main():
     # Define file paths and other settings.
     # ifc_path = "./test_data/ifc/3.002 01-05-0501_EG.ifc"
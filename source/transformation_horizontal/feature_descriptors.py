@@ -0,0 +1,99 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from source.transformation_horizontal.detect_features import compute_feature_neighbours
+
+
+# Columns of the descriptor array returned by compute_feature_descriptors.
+FEATURE_DESCRIPTORS = ("edge_in", "edge_out", "triangle_area", "convexity", "centroid_distance")
+
+
+def compute_feature_descriptors(features: np.array) -> np.array:
+    """
+    Compute rigid-invariant descriptors for every detected feature in one vectorized pass.
+    Neighbours are the adjacent detected features of the same polygon (see compute_feature_neighbours),
+    so the descriptors describe the feature set they are computed on, e.g. after filtering.
+
+    Returns:
+        A (n,5) array with the columns of FEATURE_DESCRIPTORS:
+          - edge_in, edge_out: distance to the previous and next feature,
+          - triangle_area: area of the triangle with the previous and next feature,
+          - convexity: sign of the turning angle (+1 for left turns, -1 for right turns),
+          - centroid_distance: distance to the centroid of the polygon's features.
+    """
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    if len(features) == 0:
+        return np.empty((0, len(FEATURE_DESCRIPTORS)))
+
+    prev_idx, next_idx, _ = compute_feature_neighbours(features)
+    p, c, npnt = features[prev_idx, 2:4], features[:, 2:4], features[next_idx, 2:4]
+    edge_in = np.linalg.norm(c - p, axis=1)
+    edge_out = np.linalg.norm(npnt - c, axis=1)
+    area = 0.5 * np.abs(p[:, 0] * (c[:, 1] - npnt[:, 1]) + c[:, 0] * (npnt[:, 1] - p[:, 1]) + npnt[:, 0] * (p[:, 1] - c[:, 1]))
+    convexity = np.sign(features[:, 4])
+
+    _, polygon = np.unique(features[:, 0].astype(np.int64), return_inverse=True)
+    counts = np.bincount(polygon)
+    centroids = np.column_stack([np.bincount(polygon, c[:, 0]), np.bincount(polygon, c[:, 1])]) / counts[:, None]
+    centroid_distance = np.linalg.norm(c - centroids[polygon], axis=1)
+
+    return np.column_stack([edge_in, edge_out, area, convexity, centroid_distance])
+
+
+class Feature_Descriptor_Index:
+    """
+    Index over the target features for retrieving the compatible target features of a source feature.
+
+    A target feature is compatible if its turning angle differs by less than angle_tol (radians) and each descriptor
+    named in descriptor_tol (see FEATURE_DESCRIPTORS) differs by less than the given tolerance, e.g.
+    {"edge_in": 2.0, "edge_out": 2.0, "convexity": 1.0}. All values are scaled by their tolerance and stored in a
+    KD-tree, so compatible features are found with one ball query in the maximum norm instead of a scan.
+    """
+
+    def __init__(self, target_features: np.array, angle_tol, descriptor_tol=None):
+        descriptor_tol = descriptor_tol or {}
+        unknown = set(descriptor_tol) - set(FEATURE_DESCRIPTORS)
+        if unknown:
+            raise ValueError(f"Unknown feature descriptors {sorted(unknown)}. Use any of {list(FEATURE_DESCRIPTORS)}.")
+        self.columns = [FEATURE_DESCRIPTORS.index(name) for name in descriptor_tol]
+        self.tolerances = np.array([angle_tol, *descriptor_tol.values()], dtype=float)
+        self.values = self.describe(target_features)
+        self.tree = cKDTree(self.values / self.tolerances) if len(self.values) else None
+
+    def __len__(self):
+        return len(self.values)
+
+    def describe(self, features: np.array) -> np.array:
+        """
+        Turning angle (radians) and the indexed descriptors of the given features as a (n, 1 + d) array.
+        """
+        features = np.asarray(features, dtype=float).reshape(-1, 5)
+        descriptors = compute_feature_descriptors(features)[:, self.columns]
+        return np.column_stack([np.radians(features[:, 4]), descriptors])
+
+    def query(self, source_features: np.array) -> list:
+        """
+        Return for every source feature the sorted array of indices of its compatible target features.
+        """
+        values = self.describe(source_features)
+        if self.tree is None:
+            return [np.empty(0, dtype=np.intp) for _ in range(len(values))]
+        neighbours = self.tree.query_ball_point(values / self.tolerances, r=1.0, p=np.inf)
+        compatible = []
+        for value, candidates in zip(values, neighbours):
+            candidates = np.array(sorted(candidates), dtype=np.intp)
+            # The ball query includes its boundary, the tolerances are strict.
+            if candidates.size:
+                candidates = candidates[np.all(np.abs(self.values[candidates] - value) < self.tolerances, axis=1)]
+            compatible.append(candidates)
+        return compatible
+
+    def compatibility_matrix(self, source_features: np.array) -> np.array:
+        """
+        Boolean (n_source, n_target) matrix of compatible feature pairs, like compute_angle_compatibility.
+        """
+        compatible = self.query(source_features)
+        matrix = np.zeros((len(compatible), len(self)), dtype=bool)
+        rows = np.repeat(np.arange(len(compatible)), [len(candidates) for candidates in compatible])
+        matrix[rows, np.concatenate(compatible) if compatible else np.empty(0, dtype=np.intp)] = True
+        return matrix
@@ -0,0 +1,100 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely.geometry import Polygon, MultiPolygon
+
+from source.transformation_horizontal.rigid_transformation import Rigid_Transformation
+
+
+def resample_footprint_boundary(footprint, spacing=0.5):
+    """
+    Densely resample the boundary of a footprint (exterior and interior rings of a Polygon or MultiPolygon)
+    with one sample at least every spacing units along each edge.
+
+    Returns:
+        A tuple (points, normals) with the (n,2) sample points and the (n,2) unit normals of the edges they lie on.
+    """
+    polygons = list(footprint.geoms) if isinstance(footprint, MultiPolygon) else [footprint]
+    rings = [np.asarray(ring.coords)[:, :2] for polygon in polygons if isinstance(polygon, Polygon) and not polygon.is_empty
+             for ring in [polygon.exterior, *polygon.interiors]]
+    if not rings:
+        return np.empty((0, 2)), np.empty((0, 2))
+
+    # All edges of all rings, without the degenerate ones
+    starts = np.concatenate([ring[:-1] for ring in rings])
+    edges = np.concatenate([ring[1:] for ring in rings]) - starts
+    lengths = np.linalg.norm(edges, axis=1)
+    keep = lengths > 1e-9
+    starts, edges, lengths = starts[keep], edges[keep], lengths[keep]
+
+    # Split every edge into samples_per_edge equal steps, starting at its first vertex
+    samples_per_edge = np.maximum(np.ceil(lengths / spacing).astype(np.intp), 1)
+    edge_idx = np.repeat(np.arange(len(starts)), samples_per_edge)
+    first_sample = np.cumsum(samples_per_edge) - samples_per_edge
+    fractions = (np.arange(len(edge_idx)) - first_sample[edge_idx]) / samples_per_edge[edge_idx]
+
+    points = starts[edge_idx] + fractions[:, None] * edges[edge_idx]
+    normals = np.column_stack([-edges[:, 1], edges[:, 0]]) / lengths[:, None]
+    return points, normals[edge_idx]
+
+
+def refine_rigid_transformation_icp(source_footprint, target_footprint, initial_transformation: Rigid_Transformation,
+                                    spacing=0.5, max_distance=1.0, max_iterations=50, rotation_tol=1e-7,
+                                    translation_tol=1e-5, min_correspondences=10):
+    """
+    Refine a rigid transformation with point-to-line ICP on the densely resampled footprint boundaries.
+
+    Unlike refine_rigid_transformation, which only uses the matched corners, every iteration matches all boundary
+    samples of the transformed source footprint to their nearest target boundary sample (KD-tree) and minimises the
+    distances to the target edges through those samples. Pairs farther apart than max_distance are rejected, so
+    parts that only exist in one footprint do not pull the result. The rotation is linearised around the centroid
+    of the matched points, which keeps the update well conditioned for large (e.g. UTM) coordinates.
+
+    Iteration stops once the update drops below rotation_tol (radians) and translation_tol, or after max_iterations.
+
+    Args:
+        source_footprint: Polygon or MultiPolygon in source coordinates.
+        target_footprint: Polygon or MultiPolygon in target coordinates.
+        initial_transformation: Transformation from source to target, e.g. from refine_rigid_transformation.
+        spacing: Maximum distance between boundary samples.
+        max_distance: Maximum distance of a sample to its nearest target sample to be used as correspondence.
+
+    Returns:
+        The refined Rigid_Transformation, or None if there are too few correspondences.
+    """
+    source_points, _ = resample_footprint_boundary(source_footprint, spacing)
+    target_points, target_normals = resample_footprint_boundary(target_footprint, spacing)
+    if len(source_points) < min_correspondences or len(target_points) < min_correspondences:
+        print("Not enough boundary samples for ICP refinement. Returning None.")
+        return None
+    target_tree = cKDTree(target_points)
+
+    theta = float(initial_transformation.theta)
+    t = np.asarray(initial_transformation.translation_vector(), dtype=float).reshape(2)
+    for iteration in range(max_iterations):
+        rotation = Rigid_Transformation(theta=theta).rotation_matrix()
+        moved = source_points @ rotation.T + t
+
+        distances, nearest = target_tree.query(moved, distance_upper_bound=max_distance)
+        valid = np.isfinite(distances)
+        if np.count_nonzero(valid) < min_correspondences:
+            print(f"ICP refinement stopped at iteration {iteration + 1}: not enough correspondences within {max_distance}.")
+            return None if iteration == 0 else Rigid_Transformation(t=t, theta=theta)
+
+        p, q, n = moved[valid], target_points[nearest[valid]], target_normals[nearest[valid]]
+        centroid = p.mean(axis=0)
+        centred = p - centroid
+
+        # Linearised point-to-line residual ((p + d_theta * perp(p - c) + d_t - q) . n) for [d_theta, d_tx, d_ty]
+        A = np.column_stack([centred[:, 0] * n[:, 1] - centred[:, 1] * n[:, 0], n[:, 0], n[:, 1]])
+        b = -np.einsum("ij,ij->i", p - q, n)
+        (d_theta, d_tx, d_ty), *_ = np.linalg.lstsq(A, b, rcond=None)
+
+        # Compose the update x -> R(d_theta) (x - c) + c + d_t with the current transformation
+        d_rotation = Rigid_Transformation(theta=d_theta).rotation_matrix()
+        theta += d_theta
+        t = d_rotation @ (t - centroid) + centroid + np.array([d_tx, d_ty])
+
+        if abs(d_theta) < rotation_tol and np.hypot(d_tx, d_ty) < translation_tol:
+            break
+
+    return Rigid_Transformation(t=t, theta=theta)
@@ -0,0 +1,260 @@
+import os
+import atexit
+import threading
+import contextlib
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+
+from source.transformation_horizontal.score_inliers import Target_Feature_Index
+
+
+# Long-lived process pool shared by all registration calls, created on first use.
+# users counts the registration calls currently using the pool; the pool is not replaced or shut down while in use.
+# broken marks a pool that lost a worker (see discard_registration_pool); it is replaced once its users are done.
+_registration_pool = {"executor": None, "max_workers": None, "users": 0, "broken": False}
+_registration_pool_lock = threading.RLock()
+_registration_pool_released = threading.Condition(_registration_pool_lock)
+
+# Features of the current registration call as seen by a worker process, keyed by the shared memory name.
+_worker_features = {"name": None, "shm": None, "source_features": None, "target_features": None,
+                    "target_index": None, "best_score": None}
+
+
+class Best_Score:
+    """
+    Running best inlier count of one registration call, used as the bound for early candidate rejection.
+    When backed by shared memory, every worker sees the best score found by the others. Concurrent updates may
+    lose a raise of the bound, but the stored value never exceeds a score that was actually found.
+    """
+
+    def __init__(self, buffer=None):
+        self.value = np.zeros(1) if buffer is None else np.ndarray((1,), dtype=float, buffer=buffer)
+
+    def get(self) -> int:
+        return int(self.value[0])
+
+    def update(self, score):
+        if score > self.value[0]:
+            self.value[0] = score
+
+
+class Shared_Features:
+    """
+    Publishes the source and target feature arrays of one registration call in shared memory,
+    so worker processes read them once instead of receiving a pickled copy with every task.
+    The block starts with one slot holding the shared best score (see Best_Score).
+    Use as a context manager; the shared memory block is released on exit.
+    """
+
+    def __init__(self, source_features: np.array, target_features: np.array):
+        source_features = np.asarray(source_features, dtype=float).reshape(-1, 5)
+        target_features = np.asarray(target_features, dtype=float).reshape(-1, 5)
+        self.n_source, self.n_target = len(source_features), len(target_features)
+        self.shm = shared_memory.SharedMemory(create=True, size=(1 + (self.n_source + self.n_target) * 5) * 8)
+        buffer = np.ndarray(1 + (self.n_source + self.n_target) * 5, dtype=float, buffer=self.shm.buf)
+        buffer[0] = 0
+        buffer[1:] = np.concatenate([source_features, target_features]).ravel()
+        del buffer
+
+    def spec(self):
+        """
+        Picklable description of the shared block that is sent to the workers instead of the arrays.
+        """
+        return self.shm.name, self.n_source, self.n_target
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def get_registration_pool(max_workers=None) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Return the long-lived process pool used for candidate evaluation, creating it on first use.
+    Worker processes (and their imports) are reused across registration calls; max_workers defaults to the number
+    of CPUs. The pool is thread-safe: it only grows, and only while no registration call is using it (see
+    use_registration_pool). Calls requesting fewer workers than the pool has limit their own concurrency instead.
+    A broken pool (a worker died, e.g. killed for running out of memory) is replaced by a new one as soon as the
+    calls still using it have failed.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    with _registration_pool_lock:
+        executor = _registration_pool["executor"]
+        if executor is not None and (_registration_pool["broken"] or not is_pool_usable(executor)):
+            _registration_pool["broken"] = True
+            _registration_pool_released.wait_for(lambda: _registration_pool["users"] == 0)
+            if _registration_pool["executor"] is executor:
+                _registration_pool["executor"] = None
+                _registration_pool["broken"] = False
+                executor.shutdown(wait=False, cancel_futures=True)
+        executor = _registration_pool["executor"]
+        if executor is not None and max_workers > _registration_pool["max_workers"] and _registration_pool["users"] == 0:
+            _registration_pool["executor"] = None
+            executor.shutdown(wait=True)
+        if _registration_pool["executor"] is None:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+            start_pool_workers(executor, max_workers)
+            _registration_pool["executor"] = executor
+            _registration_pool["max_workers"] = max_workers
+        return _registration_pool["executor"]
+
+
+def is_pool_usable(executor) -> bool:
+    """
+    Whether a pool still accepts work. Submitting a no-op task fails at once if a worker has died or the
+    pool was shut down.
+    """
+    try:
+        executor.submit(int)
+    except (BrokenProcessPool, RuntimeError):
+        return False
+    return True
+
+
+def discard_registration_pool(executor):
+    """
+    Mark the shared pool as broken after one of its calls failed with BrokenProcessPool, so the next call
+    gets a new pool instead of failing as well.
+    """
+    with _registration_pool_lock:
+        if _registration_pool["executor"] is executor:
+            _registration_pool["broken"] = True
+
+
+def start_pool_workers(executor, max_workers):
+    """
+    Start all worker processes of a new pool right away. Workers are otherwise forked lazily on submit, possibly
+    while other threads (e.g. concurrent registration calls) hold locks that the forked worker would then block on.
+    The resource tracker is started first, so the workers share it and do not report the shared feature blocks
+    they attach to as leaked.
+    """
+    resource_tracker.ensure_running()
+    concurrent.futures.wait([executor.submit(int) for _ in range(max_workers)])
+
+
+@contextlib.contextmanager
+def use_registration_pool(max_workers=None):
+    """
+    Use the long-lived process pool for one registration call: yields (executor, pool_size) and keeps the pool
+    from being replaced or shut down by other threads until the call is done.
+    """
+    with _registration_pool_lock:
+        executor = get_registration_pool(max_workers)
+        pool_size = _registration_pool["max_workers"]
+        _registration_pool["users"] += 1
+    try:
+        yield executor, pool_size
+    finally:
+        with _registration_pool_lock:
+            _registration_pool["users"] -= 1
+            _registration_pool_released.notify_all()
+
+
+def shutdown_registration_pool():
+    """
+    Shut down the long-lived process pool, if it was created and is not in use. It is recreated on the next use.
+    """
+    with _registration_pool_lock:
+        if _registration_pool["users"] > 0:
+            print("Warning: The registration pool is in use and was not shut down.")
+            return
+        executor = _registration_pool["executor"]
+        _registration_pool["executor"] = None
+        _registration_pool["max_workers"] = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+atexit.register(shutdown_registration_pool)
+
+
+def load_shared_features(spec):
+    """
+    Worker side: return (source_features, target_features, target_index, best_score) for a shared feature block.
+    The arrays are copied out of shared memory and the target index is built only once per registration call;
+    the block stays attached for the shared best score until the next registration call arrives.
+    """
+    name, n_source, n_target = spec
+    if _worker_features["name"] != name:
+        release_shared_features()
+        shm = shared_memory.SharedMemory(name=name)
+        features = np.ndarray((n_source + n_target, 5), dtype=float, buffer=shm.buf, offset=8).copy()
+        _worker_features["name"] = name
+        _worker_features["shm"] = shm
+        _worker_features["source_features"] = features[:n_source]
+        _worker_features["target_features"] = features[n_source:]
+        _worker_features["target_index"] = Target_Feature_Index(features[n_source:])
+        _worker_features["best_score"] = Best_Score(shm.buf[:8])
+    return (_worker_features["source_features"], _worker_features["target_features"],
+            _worker_features["target_index"], _worker_features["best_score"])
+
+
+def release_shared_features():
+    """
+    Worker side: detach from the shared feature block of the previous registration call.
+    """
+    shm = _worker_features.get("shm")
+    for key in _worker_features:
+        _worker_features[key] = None
+    if shm is not None:
+        shm.close()
+
+
+def run_shared_chunk(func, spec, chunk_idx, chunk, kwargs):
+    """
+    Worker side: evaluate one chunk with the shared features and best score of the registration call.
+    """
+    source_features, target_features, target_index, best_score = load_shared_features(spec)
+    return chunk_idx, func(chunk, source_features, target_features, target_index, best_score=best_score, **kwargs)
+
+
+def map_candidate_chunks(func, chunks, source_features, target_features, max_workers=None, executor=None, **kwargs):
+    """
+    Evaluate candidate chunks as func(chunk, source_features, target_features, target_index, best_score=best_score, **kwargs)
+    and yield (chunk_idx, result) pairs as they complete. best_score is a Best_Score shared by all chunks of the call.
+
+    Chunks are evaluated in the given executor or, by default, in the long-lived registration pool
+    (see use_registration_pool): the feature arrays are shipped once via shared memory and at most two chunks
+    per worker are in flight. If the shared pool has more workers than max_workers, at most max_workers chunks of
+    this call are in flight. If a worker of the shared pool dies, the call raises BrokenProcessPool and the pool is
+    replaced for the following calls (see get_registration_pool). With max_workers == 1 the chunks are evaluated serially in the calling process,
+    which avoids all inter-process overhead for small inputs.
+    """
+    if max_workers == 1 or (executor is None and (os.cpu_count() or 1) == 1):
+        target_index = Target_Feature_Index(target_features)
+        best_score = Best_Score()
+        for chunk_idx, chunk in enumerate(chunks):
+            yield chunk_idx, func(chunk, source_features, target_features, target_index, best_score=best_score, **kwargs)
+        return
+
+    shared_pool = executor is None
+    pool = use_registration_pool(max_workers) if shared_pool else contextlib.nullcontext((executor, None))
+    with pool as (executor, pool_size), Shared_Features(source_features, target_features) as shared:
+        if max_workers and pool_size and pool_size > max_workers:
+            max_pending = max_workers
+        else:
+            max_pending = 2 * (max_workers or os.cpu_count() or 1)
+        spec = shared.spec()
+        pending = set()
+        try:
+            for chunk_idx, chunk in enumerate(chunks):
+                pending.add(executor.submit(run_shared_chunk, func, spec, chunk_idx, chunk, kwargs))
+                if len(pending) >= max_pending:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in concurrent.futures.as_completed(pending):
+                yield future.result()
+        except BrokenProcessPool:
+            if shared_pool:
+                discard_registration_pool(executor)
+            raise
+        finally:
+            # The pool outlives this call, so outstanding chunks must finish before the shared block is released.
+            for future in pending:
+                future.cancel()
+            concurrent.futures.wait(pending)
@@ -0,0 +1,170 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# Upper bound for the number of transformed source points queried against the index at once.
+MAX_BLOCK_POINTS = 1_000_000
+# Number of nearest target features inspected per query before falling back to a radius search.
+NEAREST_NEIGHBOURS = 8
+
+
+def feature_points_and_angles(features: np.array):
+    """
+    Split a feature array into its coordinates and turning angles.
+    Each feature is expected to be in the form:
+       [polygon_index, vertex_index, x, y, turning_angle_deg]
+
+    Returns:
+        A tuple (points, angles) with points as a (n,2) array and the turning angles in radians as a (n,) array.
+    """
+    features = np.asarray(features, dtype=float).reshape(-1, 5)
+    return features[:, 2:4], np.radians(features[:, 4])
+
+
+def transform_points(thetas: np.array, translations: np.array, points: np.array) -> np.array:
+    """
+    Apply K rigid transformations to the same set of N points in one operation.
+
+    Args:
+        thetas: (K,) array of rotation angles in radians.
+        translations: (K,2) array of translation vectors.
+        points: (N,2) array of points.
+
+    Returns:
+        A (K,N,2) array holding the transformed points for every transformation.
+    """
+    cos_theta = np.cos(thetas)[:, None]
+    sin_theta = np.sin(thetas)[:, None]
+    x = points[None, :, 0]
+    y = points[None, :, 1]
+    transformed = np.empty((len(thetas), len(points), 2))
+    transformed[:, :, 0] = cos_theta * x - sin_theta * y + translations[:, 0:1]
+    transformed[:, :, 1] = sin_theta * x + cos_theta * y + translations[:, 1:2]
+    return transformed
+
+
+class Target_Feature_Index:
+    """
+    Spatial index over a target feature set.
+    The KD-tree is built once and reused for scoring every transformation candidate.
+    """
+
+    def __init__(self, target_features: np.array):
+        self.features = np.asarray(target_features, dtype=float).reshape(-1, 5)
+        self.points, self.angles = feature_points_and_angles(self.features)
+        self.tree = cKDTree(self.points) if len(self.points) else None
+
+    def __len__(self):
+        return len(self.features)
+
+    def match(self, points: np.array, angles: np.array, distance_tol, angle_tol) -> np.array:
+        """
+        Find the nearest target feature for each query point that lies within distance_tol
+        and whose turning angle differs by less than angle_tol (radians).
+
+        Returns:
+            An integer array with the index of the matched target feature for each query point (-1 if unmatched).
+        """
+        matches = np.full(len(points), -1, dtype=np.intp)
+        if self.tree is None or len(points) == 0:
+            return matches
+
+        k = min(NEAREST_NEIGHBOURS, len(self.features))
+        distances, indices = self.tree.query(points, k=k, distance_upper_bound=distance_tol)
+        distances, indices = distances.reshape(len(points), k), indices.reshape(len(points), k)
+
+        # Neighbours are sorted by distance, so the first one passing the angle gate is the nearest match.
+        found = indices < len(self.features)
+        gate = found & (distances < distance_tol)
+        gate[found] &= np.abs(angles[np.nonzero(found)[0]] - self.angles[indices[found]]) < angle_tol
+        first = np.argmax(gate, axis=1)
+        hit = gate[np.arange(len(points)), first]
+        matches[hit] = indices[hit, first[hit]]
+
+        # Rare case: all k neighbours are within range but fail the angle gate, so a farther one may still pass.
+        if k < len(self.features):
+            for row in np.nonzero(~hit & found[:, -1])[0]:
+                candidates = np.array(self.tree.query_ball_point(points[row], distance_tol), dtype=np.intp)
+                candidates = candidates[np.abs(self.angles[candidates] - angles[row]) < angle_tol]
+                if candidates.size:
+                    distances_row = np.linalg.norm(self.points[candidates] - points[row], axis=1)
+                    nearest = np.argmin(distances_row)
+                    if distances_row[nearest] < distance_tol:
+                        matches[row] = candidates[nearest]
+        return matches
+
+
+def score_transformations(thetas, translations, source_features, target_index, distance_tol, angle_tol):
+    """
+    Score a batch of transformation candidates by counting source features that land on a compatible target feature.
+
+    Each transformed source feature is matched to its nearest target feature within distance_tol whose turning
+    angle differs by less than angle_tol (radians). target_index is a Target_Feature_Index (or a plain target
+    feature array, for which an index is built on the fly).
+
+    Returns:
+        A tuple (matches, inlier_counts) where matches is a (K,N) integer array holding the index of the
+        matched target feature for every source feature (-1 if unmatched) and inlier_counts is a (K,) array.
+    """
+    if not isinstance(target_index, Target_Feature_Index):
+        target_index = Target_Feature_Index(target_index)
+    thetas = np.atleast_1d(np.asarray(thetas, dtype=float))
+    translations = np.asarray(translations, dtype=float).reshape(-1, 2)
+    source_points, source_angles = feature_points_and_angles(source_features)
+
+    n_candidates, n_source = len(thetas), len(source_points)
+    matches = np.full((n_candidates, n_source), -1, dtype=np.intp)
+    if n_candidates == 0 or n_source == 0 or len(target_index) == 0:
+        return matches, np.zeros(n_candidates, dtype=np.intp)
+
+    block_size = max(1, MAX_BLOCK_POINTS // n_source)
+    query_angles = np.tile(source_angles, min(block_size, n_candidates))
+    for start in range(0, n_candidates, block_size):
+        stop = min(start + block_size, n_candidates)
+        transformed = transform_points(thetas[start:stop], translations[start:stop], source_points)
+        block_matches = target_index.match(
+            transformed.reshape(-1, 2), query_angles[:(stop - start) * n_source], distance_tol, angle_tol
+        )
+        matches[start:stop] = block_matches.reshape(stop - start, n_source)
+
+    return matches, np.count_nonzero(matches >= 0, axis=1)
+
+
+def score_transformations_bounded(thetas, translations, source_features, target_index, distance_tol, angle_tol,
+                                  min_score=0, best_score=None, stage_size=16):
+    """
+    Branch-and-bound variant of score_transformations that only counts inliers.
+
+    Source features are scored in stages of stage_size features. After each stage, candidates whose inlier count
+    plus the number of remaining source features cannot reach the bound anymore are dropped. The bound is min_score
+    or, if higher, the current value of best_score (an object with a get() method, e.g. a best score shared between
+    worker processes), so a dominant hypothesis found elsewhere lets most candidates be rejected after a few features.
+
+    Returns:
+        A (K,) array of inlier counts, with -1 for rejected candidates.
+    """
+    if not isinstance(target_index, Target_Feature_Index):
+        target_index = Target_Feature_Index(target_index)
+    thetas = np.atleast_1d(np.asarray(thetas, dtype=float))
+    translations = np.asarray(translations, dtype=float).reshape(-1, 2)
+    source_points, source_angles = feature_points_and_angles(source_features)
+
+    n_source = len(source_points)
+    inlier_counts = np.zeros(len(thetas), dtype=np.intp)
+    alive = np.arange(len(thetas))
+    for start in range(0, n_source, stage_size):
+        if alive.size == 0:
+            break
+        stop = min(start + stage_size, n_source)
+        transformed = transform_points(thetas[alive], translations[alive], source_points[start:stop])
+        stage_matches = target_index.match(
+            transformed.reshape(-1, 2), np.tile(source_angles[start:stop], len(alive)), distance_tol, angle_tol
+        )
+        inlier_counts[alive] += np.count_nonzero(stage_matches.reshape(len(alive), stop - start) >= 0, axis=1)
+
+        bound = min_score if best_score is None else max(min_score, best_score.get())
+        reachable = inlier_counts[alive] + (n_source - stop) >= bound
+        inlier_counts[alive[~reachable]] = -1
+        alive = alive[reachable]
+
+    return inlier_counts
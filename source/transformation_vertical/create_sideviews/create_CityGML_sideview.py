@@ -4,56 +4,40 @@ import xml.etree.ElementTree as ET
 from shapely.geometry import Polygon, MultiPolygon
 from shapely.ops import unary_union
 
+from source.read_CityGML import decode_poslist, iterate_CityGML_building_geometry
+
 def create_CityGML_sideview(citygml_path, building_ids: list) -> MultiPolygon:
     try:
-        tree = ET.parse(citygml_path)
-        root = tree.getroot()
-        ns = {
-            'bldg': 'http://www.opengis.net/citygml/building/2.0',
-            'gml': 'http://www.opengis.net/gml'
-        }
+        # Stream the requested buildings (or every Building in the file) instead of parsing the whole file
+        sideviews = {}
+        for b_id, poslists in iterate_CityGML_building_geometry(citygml_path, building_ids):
+            # include all surfaces: every posList under this Building
+            if not poslists:
+                print(f"Warning: No geometry found in building '{b_id or 'unknown'}'.")
+            polygons = sideviews.setdefault(b_id, [])
+            for poslist in poslists:
+                coords = decode_poslist(poslist)
+                # side-view: take Y,Z
+                points = coords[:, 1:]
+                if len(points) >= 3:
+                    poly = Polygon(points)
+                    if poly.is_valid:
+                        polygons.append(poly)
+                    else:
+                        print("Warning: An invalid polygon was created; skipping it.")
+                else:
+                    print("Warning: Not enough points to form a polygon; skipping.")
+
         polygons = []
         if building_ids:
             for b_id in building_ids:
-                building = root.find(f".//bldg:Building[@gml:id='{b_id}']", ns)
-                if building is None:
+                if b_id not in sideviews:
                     print(f"Warning: No building found with gml:id '{b_id}'.")
                     continue
-                # include all surfaces: grab every posList under this Building
-                poslists = building.findall('.//gml:posList', ns)
-                if not poslists:
-                    print(f"Warning: No geometry found in building '{b_id}'.")
-                for poslist in poslists:
-                    coords = list(map(float, poslist.text.split()))
-                    # side-view: take Y,Z
-                    points = [(coords[i + 1], coords[i + 2]) for i in range(0, len(coords), 3)]
-                    if len(points) >= 3:
-                        poly = Polygon(points)
-                        if poly.is_valid:
-                            polygons.append(poly)
-                        else:
-                            print("Warning: An invalid polygon was created; skipping it.")
-                    else:
-                        print("Warning: Not enough points to form a polygon; skipping.")
+                polygons.extend(sideviews[b_id])
         else:
-            # no IDs: process every Building in the file
-            for building in root.findall('.//bldg:Building', ns):
-                bid = building.get('{http://www.opengis.net/gml}id', 'unknown')
-                poslists = building.findall('.//gml:posList', ns)
-                if not poslists:
-                    print(f"Warning: No geometry found in building '{bid}'.")
-                for poslist in poslists:
-                    coords = list(map(float, poslist.text.split()))
-                    # side-view: take Y,Z
-                    points = [(coords[i + 1], coords[i + 2]) for i in range(0, len(coords), 3)]
-                    if len(points) >= 3:
-                        poly = Polygon(points)
-                        if poly.is_valid:
-                            polygons.append(poly)
-                        else:
-                            print("Warning: An invalid polygon was created; skipping it.")
-                    else:
-                        print("Warning: Not enough points to form a polygon; skipping.")
+            for building_polygons in sideviews.values():
+                polygons.extend(building_polygons)
         
         # union all wall polygons into disjoint MultiPolygon
         if not polygons:
@@ -1,56 +1,31 @@
+import numpy as np
 import xml.etree.ElementTree as ET
 from shapely.geometry import Polygon
 
+from source.read_CityGML import decode_poslist, get_CityGML_index, iterate_CityGML_building_geometry
+
 def find_CityGML_extent(citygml_path, building_ids=None):
     try:
-        tree = ET.parse(citygml_path)
-        root = tree.getroot()
-        ns_2_0 = {
-            'bldg': 'http://www.opengis.net/citygml/building/2.0',
-            'gml': 'http://www.opengis.net/gml'
-        }
-        ns_1_0 = {
-            'bldg': 'http://www.opengis.net/citygml/building/1.0',
-            'gml': 'http://www.opengis.net/gml'
-        }
         min_z, max_z = float("inf"), float("-inf")
 
-        # Try both namespaces for buildings
-        def get_buildings(ns):
-            return root.findall('.//bldg:Building', ns)
-
-        def get_building_by_id(b_id, ns):
-            return root.find(f".//bldg:Building[@gml:id='{b_id}']", ns)
-
-        # Try to detect which namespace is present
-        buildings = get_buildings(ns_2_0)
-        ns = ns_2_0
-        if not buildings:
-            buildings = get_buildings(ns_1_0)
-            ns = ns_1_0
-
         if building_ids:
+            # The z-ranges of the requested buildings are stored in the tile index, no geometry has to be parsed
+            index = get_CityGML_index(citygml_path)
             for b_id in building_ids:
-                building = get_building_by_id(b_id, ns)
-                if building is None:
+                if b_id not in index:
                     print(f"Warning: No building found with gml:id '{b_id}'.")
-                    continue
-                poslists = building.findall('.//gml:posList', ns)
-                for poslist in poslists:
-                    coords = list(map(float, poslist.text.split()))
-                    for i in range(2, len(coords), 3):  # Extract Z-coordinates
-                        z = coords[i]
-                        min_z = min(min_z, z)
-                        max_z = max(max_z, z)
+            z_range = index.z_range(building_ids)
+            if z_range is not None:
+                min_z, max_z = z_range
         else:
-            for building in buildings:
-                poslists = building.findall('.//gml:posList', ns)
-                for poslist in poslists:
-                    coords = list(map(float, poslist.text.split()))
-                    for i in range(2, len(coords), 3):  # Extract Z-coordinates
-                        z = coords[i]
-                        min_z = min(min_z, z)
-                        max_z = max(max_z, z)
+            # Stream all buildings instead of parsing the whole file
+            for _, poslists in iterate_CityGML_building_geometry(citygml_path):
+                if not poslists:
+                    continue
+                z = np.concatenate([decode_poslist(poslist)[:, 2] for poslist in poslists])  # Extract Z-coordinates
+                if z.size:
+                    min_z = min(min_z, float(z.min()))
+                    max_z = max(max_z, float(z.max()))
 
         if min_z == float("inf") or max_z == float("-inf"):
             print("No valid Z-coordinates found in the CityGML file.")
@@ -0,0 +1,50 @@
+import os
+import time
+import signal
+from unittest import mock
+
+import numpy as np
+
+from source.transformation_horizontal.estimate_rigid_transformation import estimate_rigid_transformation
+from source.transformation_horizontal.registration_pool import get_registration_pool, shutdown_registration_pool
+
+
+def create_features(n=40, seed=0):
+    """
+    Random source features and the same features shifted into georeferenced target coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    source_features = np.column_stack([np.zeros(n), np.arange(n), rng.uniform(0, 100, (n, 2)), rng.uniform(-90, 90, n)])
+    target_features = source_features.copy()
+    target_features[:, 2:4] += [690000, 5336000]
+    return source_features, target_features
+
+
+def test_registration_pool_recovers_from_killed_worker():
+    """
+    A worker of the shared registration pool that dies (e.g. killed for running out of memory) must not break
+    the following registration calls.
+    """
+    source_features, target_features = create_features()
+    kwargs = dict(distance_tol=1, angle_tol_deg=10, mode="exhaustive", max_workers=2, min_parallel_candidates=0,
+                  chunk_size=256)
+    # Force the pool even on single-CPU machines, where the chunks would be evaluated serially
+    with mock.patch("os.cpu_count", return_value=2):
+        try:
+            _, inliers = estimate_rigid_transformation(source_features, target_features, **kwargs)
+            assert len(inliers) == len(source_features)
+
+            worker_pid = get_registration_pool(2).submit(os.getpid).result()
+            os.kill(worker_pid, signal.SIGKILL)
+            time.sleep(1.0)
+
+            for _ in range(2):
+                _, inliers = estimate_rigid_transformation(source_features, target_features, **kwargs)
+                assert len(inliers) == len(source_features)
+        finally:
+            shutdown_registration_pool()
+
+
+if __name__ == "__main__":
+    test_registration_pool_recovers_from_killed_worker()
+    print("The registration pool recovered from a killed worker.")